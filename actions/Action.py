@@ -1,5 +1,14 @@
+import importlib
+
+
 class Action:
-    """This class describe an action of the program."""
+    """This class describe an action of the program.
+
+    target is either the function to run, or its dotted path (e.g. "actions.trajectory.trajectory").
+    A dotted path is only imported when the action runs, so the dependencies of the actions that
+    are not run are never loaded.
+    If context.profiler is set (a utility.Profiler), the action is timed as a stage named after it.
+    """
 
     def __init__(self, name, priority, target):
         self.name = name
@@ -7,4 +16,12 @@ class Action:
         self.target = target
 
     def run(self, context):
-        self.target(context=context)
+        target = self.target
+        if isinstance(target, str):
+            module, function = target.rsplit(".", 1)
+            target = getattr(importlib.import_module(module), function)
+        if context.profiler is None:
+            target(context=context)
+        else:
+            with context.profiler.stage(self.name):
+                target(context=context)
@@ -1,4 +1,8 @@
 from .Action import Action
-from .downloadTLE import downloadTLE
-from .trajectory import trajectory
-from .opengl import view3D
+
+# The actions themselves (actions.downloadTLE.downloadTLE, actions.trajectory.trajectory and actions.opengl.view3D)
+# are imported by Action.run, only when they are needed: they depend on skyfield and OpenGL.
+
+# Values accepted by the --format and --propagator options
+OUTPUT_FORMATS = ("csv", "npy")
+PROPAGATORS = ("skyfield", "sgp4")
@@ -0,0 +1,118 @@
+"""Attenuation calculation as a library: arrays in, arrays out.
+
+Nothing is read nor written on disk (unless a cache is given), and no Context is needed:
+
+    from actions.api import compute_attenuation
+    result = compute_attenuation(times, longitudes, latitudes, altitudes, {"24793": (tle1, tle2)}, 1616e6)
+    result.path_loss, result.los, result.best_relay()
+
+The command line (actions.trajectory.trajectory) calculates the chunks with the same functions and writes them to a file.
+"""
+from skyfield.api import Loader
+
+import numpy as np
+
+from .propagation import Relay, make_relays
+from .trajectory import attenuation_chunks
+
+
+_timescale = None
+
+
+def timescale():
+    """The skyfield timescale, built once from the data bundled with skyfield."""
+    global _timescale
+    if _timescale is None:
+        _timescale = Loader(".").timescale()
+    return _timescale
+
+
+def relays_from_tles(tles):
+    """Build the relays from their TLE.
+
+    Args:
+        tles: dict of name -> (line1, line2) or -> Relay, or a sequence of (name, line1, line2) where a name can be
+            repeated to give several element sets of the same relay (see actions.propagation.Relay)
+    Returns:
+        dict of name -> Relay
+    """
+    if isinstance(tles, dict):
+        relays = {str(name): tle if isinstance(tle, Relay) else Relay(tle[0], tle[1], str(name)) for name, tle in tles.items()}
+    else:
+        relays = make_relays((str(name), line1, line2) for name, line1, line2 in tles)
+    if not relays:
+        raise RuntimeError("No relay is given.")
+    return relays
+
+
+class Attenuation:
+    """Result of compute_attenuation, for N points and M relays.
+
+    Attributes:
+        relays: the names of the M relays
+        time, longitude, latitude, altitude: (N,) the points of the trajectory
+        distance: (N, M) distance between the target and each relay, in meters
+        los: (N, M) whether or not each relay is in line of sight
+        path_loss: (N, M) path loss in dB, NaN when the relay is not in sight, (N, M, F) with F frequencies
+        minimum_index: (N,) index of the closest relay in sight, -1 if none
+        minimum_dist, minimum_path_loss: (N,) distance and path loss of the closest relay in sight (inf if none)
+        relays_position: (N, M, 3) longitude (°), latitude (°) and altitude (m) of the relays, only with write_trajectories
+    """
+
+    def __init__(self, relays, arrays):
+        self.relays = relays
+        self.relays_position = None
+        self._keys = list(arrays)
+        for key, value in arrays.items():
+            setattr(self, key, value)
+
+    def arrays(self):
+        """dict of the name of each array -> array, relays_position only with write_trajectories."""
+        return {key: getattr(self, key) for key in self._keys}
+
+    def best_relay(self):
+        """(N,) names of the closest relay in sight at each point, None if none."""
+        names = np.array(list(self.relays) + [None], dtype=object)
+        return names[self.minimum_index]
+
+
+def compute_attenuation(times, longitudes, latitudes, altitudes, tles, frequency=1616e6, write_trajectories=False,
+                        chunk_size=1000, jobs=1, cache=None, interpolation=None, propagator="skyfield", adaptive=None, stats=None,
+                        ephemeris=None):
+    """Calculate the distance, line of sight and path loss between a target and every relay, along a trajectory.
+
+    Args:
+        times: UTC Epoch timestamps of the points, in seconds
+        longitudes, latitudes: position of the target at each point, in degrees
+        altitudes: altitude of the target at each point, in meters
+        tles: the TLE of the relays, see relays_from_tles
+        frequency: the frequency of the carrier in hertz, or a sequence of frequencies
+        write_trajectories: also return the positions of the relays
+        chunk_size: number of points calculated at once, bounds the memory used by the calculation
+        jobs: number of worker processes
+        cache: an utility.ArrayCache of the relays positions, or None
+        interpolation, propagator, adaptive: see actions.trajectory.attenuation_chunk
+        stats: dict updated with the statistics of the calculation (see actions.trajectory.merge_stats), or None
+        ephemeris: an object with a positions(epoch_times) method giving the (N, M, 3) ITRF positions of the relays
+            (like actions.propagation.Ephemeris), used instead of propagating them, or None. Only used with jobs = 1.
+    Returns:
+        an Attenuation
+    """
+    times = np.asarray(times, dtype=np.float64)
+    longitudes, latitudes, altitudes = (np.broadcast_to(np.asarray(values, dtype=np.float64), times.shape)
+                                        for values in (longitudes, latitudes, altitudes))
+    if times.ndim != 1 or len(times) == 0:
+        raise RuntimeError("The trajectory must be a non empty sequence of points.")
+    if np.any(np.asarray(frequency, dtype=np.float64) <= 0):
+        raise RuntimeError("The frequency must be positive.")
+    relays = relays_from_tles(tles)
+
+    arrays = None
+    for part, chunk in attenuation_chunks(relays, timescale(), times, longitudes, latitudes, altitudes, frequency, write_trajectories,
+                                          chunk_size, jobs, cache, stats, ephemeris, interpolation=interpolation, propagator=propagator,
+                                          adaptive=adaptive):
+        if arrays is None:
+            arrays = {key: np.empty((len(times),) + value.shape[1:], dtype=value.dtype) for key, value in chunk.items()}
+        for key, value in chunk.items():
+            arrays[key][part] = value
+    return Attenuation(list(relays), arrays)
@@ -0,0 +1,59 @@
+import urllib.parse
+
+from utility.fetch import fetch_all
+
+
+def tle_checksum(line):
+    """Checksum of a TLE line: the sum of its digits, minus signs counting as 1, modulo 10 (of the 68 first characters)."""
+    return sum(int(c) if c.isdigit() else c == '-' for c in line[:68]) % 10
+
+
+def valid_tle(line1, line2):
+    """Whether or not the two lines look like a TLE: their numbers, lengths and checksums (last character) are right."""
+    return (len(line1) == 69 and len(line2) == 69 and line1.startswith("1 ") and line2.startswith("2 ")
+            and line1[68].isdigit() and line2[68].isdigit()
+            and tle_checksum(line1) == int(line1[68]) and tle_checksum(line2) == int(line2[68]))
+
+
+def normalize_id(norad_id):
+    """Norad id without its leading zeros, so "00694" of a TLE matches "694" of the id file."""
+    norad_id = norad_id.strip()
+    return norad_id.lstrip("0") or "0" if norad_id.isdigit() else norad_id
+
+
+def read_catalogue(lines):
+    """Index the TLE of a multi-object element set file, in the 2-line or 3-line format (the names are ignored).
+
+    Args:
+        lines: iterable of the lines of the file
+    Returns:
+        dict of norad id (see normalize_id) -> (line1, line2), the last TLE of a satellite wins
+    """
+    catalogue = {}
+    line1 = None
+    for line in lines:
+        line = line.strip()
+        if line.startswith("1 ") and len(line) >= 7:
+            line1 = line
+        elif line.startswith("2 ") and line1 is not None:
+            # The satellite number is the same on both lines
+            if line[2:7] == line1[2:7]:
+                catalogue[normalize_id(line1[2:7])] = (line1, line)
+            line1 = None
+        else:
+            line1 = None
+    return catalogue
+
+
+def load_catalogue(source, context):
+    """Index the TLE of a multi-object element set file or URL, see read_catalogue.
+
+    The URL is downloaded with the options of the download (download_timeout, download_retries) of the context.
+    """
+    if urllib.parse.urlsplit(source).scheme in ("http", "https"):
+        (data,), _ = fetch_all([source], timeout=context.download_timeout, retries=context.download_retries)
+        if isinstance(data, Exception):
+            raise RuntimeError("Can not download \"{}\": {}".format(source, data))
+        return read_catalogue(data.decode("utf-8", errors="replace").splitlines())
+    with open(source, 'r', errors="replace") as file:
+        return read_catalogue(file)
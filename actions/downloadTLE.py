@@ -1,21 +1,36 @@
-from bs4 import BeautifulSoup
-import concurrent.futures
-import urllib.request
 import os.path
+import html
 import csv
+import re
 
-from utility import confirmation, header_indexes
+from utility import confirmation, header_indexes, timed
+from utility.fetch import fetch_all, FetchError
+
+from .catalogue import load_catalogue, normalize_id, valid_tle
+from .store import TLEStore
 
 
 def downloadTLE(context):
     """
-    Get the newest TLE from a satellite tracking website.
+    Get the newest TLE from a satellite tracking website, or from a multi-object element set file or URL (tle_source).
     TLE are accurate for 2 weeks after they are generated.
+    The TLE are kept in a store, only the ones missing from the store or older than tle_max_age are fetched again.
+    Every TLE of the store (up to tle_history old) is written, a satellite has one row per epoch (see actions.propagation.Relay).
 
     Args:
         id_file: the file where the norad id are read.
         save_file: the file where to save the results.
         confirm: whether or not we have to ask for confirmation.
+        tle_url: the URL of the TLE page, "{}" is replaced by the norad id.
+        tle_source: the multi-object element set file or URL the TLE are taken from instead of tle_url, or None.
+        download_concurrency: maximum number of requests in progress at the same time.
+        download_rate: maximum number of requests started per second, or None.
+        download_timeout: time allowed to each request, in seconds.
+        download_retries: number of times a request failing with a network error or a server error is retried.
+        tle_store: the file of the TLE store, see actions.store.TLEStore.
+        tle_max_age: maximum age of the epoch of the TLE taken from the store, in seconds.
+        tle_history: the TLE older than the latest one of a satellite by more than this number of seconds are dropped
+            from the store, see actions.store.TLEStore.
     """
 
     id_file = context.id_file
@@ -24,13 +39,14 @@ def downloadTLE(context):
 
     satellites_data = []  # List of all the properties of a satellite in id_file
     satellites_id = []    # List of all the norad_id
-    satellites_tle = {}   # Dict of index -> TLE, with index pointing elements of satellites_id (or satellite_data, same index)
+    satellites_tle = {}   # Dict of index -> TLE of every epoch, with index pointing elements of satellites_id (or satellite_data, same index)
     header = None
+    stats = {}            # Time spent in each stage, see utility.timed
 
     print("Downloading TLE")
 
     # Get all the norad numbers
-    with open(id_file, 'r') as csvfile:
+    with timed(stats, "id_parsing"), open(id_file, 'r') as csvfile:
         reader = csv.reader(csvfile, delimiter=',')
         header = next(reader, None)
 
@@ -45,37 +61,119 @@ def downloadTLE(context):
         if not confirmation("\"{}\" already exists. Overwrite it ?".format(save_file)):
             raise RuntimeError("Aborting download.")
 
-    # Download all TLE
-    with concurrent.futures.ThreadPoolExecutor(max_workers=20) as executor:
-        future_to_index = {executor.submit(getTLE, satellites_id[i]): i for i in range(len(satellites_id))}
-        for future in concurrent.futures.as_completed(future_to_index):
-            index = future_to_index[future]
-            try:
-                tle = future.result()
-            except Exception as exc:
-                print("Satellite #{} generated an exception: {}".format(satellites_id[index], exc))
+    # Only download the TLE missing from the store or too old
+    with timed(stats, "store_loading"):
+        store = TLEStore(context.tle_store, context.tle_history)
+    hits = [i for i in range(len(satellites_id)) if store.is_fresh(satellites_id[i], context.tle_max_age)]
+    to_fetch = sorted(set(range(len(satellites_id))) - set(hits))
+    refreshed, added, failures = [], [], []
+
+    def fetched(norad_id, tle):
+        (refreshed if store.get(norad_id) is not None else added).append(norad_id)
+        store.put(norad_id, tle[0], tle[1])
+
+    def failed(norad_id, reason):
+        failures.append(norad_id)
+        if store.get(norad_id) is not None:
+            print("Satellite #{}: {}, the TLE of the store is kept".format(norad_id, reason))
+        else:
+            print("Satellite #{}: {}".format(norad_id, reason))
+
+    if context.tle_source is not None:
+        # Filter the catalogue by norad id
+        with timed(stats, "catalogue", len(to_fetch)):
+            catalogue = load_catalogue(context.tle_source, context) if to_fetch else {}
+            for i in to_fetch:
+                tle = catalogue.get(normalize_id(satellites_id[i]))
+                if tle is not None:
+                    fetched(satellites_id[i], tle)
+                else:
+                    failed(satellites_id[i], "not in \"{}\"".format(context.tle_source))
+        origin = "{} TLE in the catalogue".format(len(catalogue))
+    else:
+        # Download the TLE pages, reusing the connections, and only read them up to the TLE
+        def downloaded(index, result):
+            tle = result if not isinstance(result, Exception) else None
+            if tle:
+                fetched(satellites_id[to_fetch[index]], tle)
             else:
-                satellites_tle[index] = tle
+                failed(satellites_id[to_fetch[index]], "download failed, {}".format(result) if tle is None else "no TLE in the page")
+
+        urls = [context.tle_url.format(satellites_id[i]) for i in to_fetch]
+        with timed(stats, "requests", len(urls)):
+            _, connections = fetch_all(urls, context.download_concurrency, context.download_rate, context.download_timeout,
+                                       context.download_retries, callback=downloaded, parser=TLEPageParser)
+        origin = "{} connections".format(connections)
+
+    with timed(stats, "store_saving"):
+        store.save()
+    print("TLE store: {} up to date, {} refreshed, {} added, {} failed ({})".format(
+        len(hits), len(refreshed), len(added), len(failures), origin))
+
+    for i in range(len(satellites_id)):
+        history = store.history(satellites_id[i])
+        if history:
+            satellites_tle[i] = history
 
     # Write the result to the csv file
-    with open(save_file, 'w', newline='') as csvfile:
+    with timed(stats, "output", len(satellites_tle)), open(save_file, 'w', newline='') as csvfile:
         spamwriter = csv.writer(csvfile, delimiter=',')
         spamwriter.writerow(header + ["tle1", "tle2"])
         for i in range(len(satellites_id)):
-            if i in satellites_tle:
-                spamwriter.writerow(satellites_data[i] + satellites_tle[i])
-            else:
-                print("Error: satellite #{} don't have any TLE".format(satellites_id[i]))
-
-
-def getTLE(noradID):
-    data = urllib.request.urlopen('https://www.n2yo.com/satellite/?s='+str(noradID)).read()
-    soup = BeautifulSoup(data, features="html.parser")
-    element = soup.find('div', attrs={'id': 'tle'})
-    if element is None:
-        return ""
-    element = element.find('pre')
-    if element is None:
-        return ""
-    TLE = element.text.strip().split('\n')
-    return [s.strip() for s in TLE]
+            for tle in satellites_tle.get(i, []):
+                spamwriter.writerow(satellites_data[i] + tle)
+
+    missing = [satellites_id[i] for i in range(len(satellites_id)) if i not in satellites_tle]
+    if missing:
+        print("Error: {} satellites don't have any TLE: {}".format(len(missing), ", ".join(missing)))
+
+    if context.profiler is not None:
+        context.profiler.add_stats(stats, "download/")
+
+
+class TLEPageParser:
+    """Incremental extraction of the TLE of a page of the tracking website: the text of <div id="tle"><pre>.
+
+    The pieces of the page are given to feed() as they are received, it returns True once the TLE is complete so the rest
+    of the page is not parsed nor kept (utility.fetch.fetch_all still reads it to reuse the connection, up to DRAIN_LIMIT).
+    Only the end of the page that can hold a partial marker is kept before the TLE.
+    close() returns the two lines of the TLE, an empty list if the page has none, and raises a FetchError if they are not
+    a valid TLE (wrong checksum).
+    """
+
+    START = re.compile(rb'<div[^>]*\bid\s*=\s*["\']?tle\b[^>]*>.*?<pre[^>]*>', re.IGNORECASE | re.DOTALL)
+    END = re.compile(rb'</pre\s*>', re.IGNORECASE)
+    # Longest opening <div ...> <pre ...> that is searched across the pieces of the page
+    MAX_START = 4096
+
+    def __init__(self):
+        self.buffer = b""
+        self.started = False
+        self.text = None
+
+    def feed(self, data):
+        if self.text is not None:
+            return True
+        self.buffer += data
+        if not self.started:
+            match = self.START.search(self.buffer)
+            if match is None:
+                self.buffer = self.buffer[-self.MAX_START:]
+                return False
+            self.started = True
+            self.buffer = self.buffer[match.end():]
+        match = self.END.search(self.buffer)
+        if match is not None:
+            self.text = self.buffer[:match.start()]
+            self.buffer = b""
+        return self.text is not None
+
+    def close(self):
+        if self.text is None:
+            return []
+        text = html.unescape(re.sub(r"<[^>]*>", "", self.text.decode("utf-8", errors="replace")))
+        # A name line may precede the TLE
+        TLE = [s.strip() for s in text.split('\n') if s.strip()][-2:]
+        if len(TLE) != 2 or not valid_tle(*TLE):
+            raise FetchError("invalid TLE in the page: {}".format(" / ".join(TLE)), retryable=False)
+        return TLE
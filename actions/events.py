@@ -0,0 +1,124 @@
+from skyfield.api import Topos
+import csv
+
+import numpy as np
+
+from .output import extra_frequencies
+from .propagation import utc_times, propagate_relays
+from .trajectory import attenuation, path_loss
+
+
+# Step, in seconds, of the coarse grid the events are bracketed on
+EVENT_STEP = 10.0
+# Accuracy of the event times, in seconds
+EVENT_TOLERANCE = 1e-3
+
+
+class VisibilityState:
+    """Line of sight and closest relay in sight at any time of a trajectory.
+
+    The target position is linearly interpolated between the points of the trajectory,
+    the relays are propagated at the requested times.
+    """
+
+    def __init__(self, satellites, ts, epoch_times, longitudes, latitudes, altitudes, propagator="skyfield"):
+        order = np.argsort(epoch_times, kind="stable")
+        self.satellites = satellites
+        self.ts = ts
+        self.times = epoch_times[order]
+        self.positions = Topos(longitude_degrees=longitudes[order], latitude_degrees=latitudes[order], elevation_m=altitudes[order]).itrs_xyz.m.T
+        self.propagator = propagator
+        # Number of times the relays have been propagated at
+        self.evaluations = 0
+
+    def target(self, epoch_times):
+        """(N, 3) ITRF positions of the target in meters."""
+        return np.column_stack([np.interp(epoch_times, self.times, self.positions[:, k]) for k in range(3)])
+
+    def at(self, epoch_times, cache=None):
+        """Distance (N, M), line of sight (N, M) and index of the closest relay in sight (N,), -1 if none."""
+        self.evaluations += len(epoch_times)
+        relays_pos = propagate_relays(self.satellites, utc_times(self.ts, epoch_times), epoch_times, cache, self.propagator)
+        dist, los, _ = attenuation(self.target(epoch_times), relays_pos, 1.0)
+        visible_dists = np.where(los, dist, np.inf)
+        best = np.argmin(visible_dists, axis=1)
+        return dist, los, np.where(np.any(los, axis=1), best, -1)
+
+
+def _bisect(state, low, high, unchanged, tolerance):
+    """Shrink the brackets [low, high] until they are shorter than tolerance.
+    unchanged(dist, los, best) tells, for every bracket, whether the state at its middle is still the one of low."""
+    while len(low) and np.max(high - low) > tolerance:
+        middle = (low + high) / 2
+        same = unchanged(*state.at(middle))
+        low = np.where(same, middle, low)
+        high = np.where(same, high, middle)
+    return low, high
+
+
+def visibility_events(state, step=EVENT_STEP, tolerance=EVENT_TOLERANCE, block_size=1000, cache=None):
+    """Find the rise and set times of every relay and the handovers between the closest relays in sight.
+
+    The state is sampled on a grid of the given step, the changes between two samples are bracketed and refined by bisection
+    to the given tolerance. Visibility windows shorter than the step can be missed.
+
+    Args:
+        state: VisibilityState of the trajectory
+        cache: ArrayCache of the relays positions on the grid, or None
+    Returns:
+        list of (time, event, relay index, previous relay index) sorted by time, event is "visible" (in sight at the start
+        of the trajectory), "rise", "set" or "handover" (change of the closest relay in sight, -1 meaning none)
+    """
+    start, end = state.times[0], state.times[-1]
+    grid = np.append(np.arange(start, end, step), end)
+
+    los_blocks, best_blocks = [], []
+    for first in range(0, len(grid), block_size):
+        _, los, best = state.at(grid[first:first+block_size], cache)
+        los_blocks.append(los)
+        best_blocks.append(best)
+    los, best = np.concatenate(los_blocks), np.concatenate(best_blocks)
+
+    events = [(start, "visible", j, -1) for j in np.flatnonzero(los[0])]
+    if best[0] >= 0:
+        events.append((start, "handover", best[0], -1))
+
+    # Rise and set: the line of sight of a relay differs at both ends of a grid interval
+    intervals, relays = np.nonzero(los[:-1] != los[1:])
+    rising = ~los[intervals, relays]
+    low, high = _bisect(state, grid[intervals], grid[intervals+1],
+                        lambda dist, los_middle, best: los_middle[np.arange(len(relays)), relays] == ~rising, tolerance)
+    # The reported time is the first instant in sight for a rise, the last one for a set
+    events.extend(zip(np.where(rising, high, low), np.where(rising, "rise", "set"), relays, np.full(len(relays), -1)))
+
+    # Handovers: the closest relay differs at both ends, there may be several handovers in one interval
+    intervals = np.flatnonzero(best[:-1] != best[1:])
+    low, high, previous, last = grid[intervals], grid[intervals+1], best[intervals], best[intervals+1]
+    while len(low):
+        low, high = _bisect(state, low, high, lambda dist, los_middle, best_middle: best_middle == previous, tolerance)
+        following = state.at(high)[2]
+        events.extend(zip(high, ["handover"] * len(high), following, previous))
+        # Look for another handover between the one just found and the end of the interval
+        again = following != last
+        low, previous, last = high[again], following[again], last[again]
+        high = grid[np.searchsorted(grid, low, side="right")]
+
+    events.sort(key=lambda event: event[0])
+    return events
+
+
+def write_events(file, state, events, names, frequency):
+    """Write the events in a CSV file, with the distance and path loss to the relay at the time of the event."""
+    times = np.array([event[0] for event in events])
+    relays = np.array([event[2] for event in events], dtype=int)
+    dist = state.at(times)[0][np.arange(len(events)), relays] if len(events) else np.empty(0)
+    losses = np.reshape(path_loss(frequency, dist), (len(events), -1)).tolist()
+
+    with open(file, 'w', newline='') as csvfile:
+        spamwriter = csv.writer(csvfile, delimiter=',')
+        spamwriter.writerow(["time (s)", "event", "relay (norad id)", "previous relay (norad id)", "distance (m)", "path_loss (dB)"]
+                            + ["path_loss" + suffix + " (dB)" for suffix in extra_frequencies(frequency)])
+        for (time, event, relay, previous), distance, loss in zip(events, dist.tolist(), losses):
+            if relay < 0:
+                distance, loss = "", [""] * len(loss)
+            spamwriter.writerow([time, event, names[relay] if relay >= 0 else "None", names[previous] if previous >= 0 else "None", distance] + loss)
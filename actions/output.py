@@ -0,0 +1,114 @@
+import io
+import csv
+
+import numpy as np
+
+from utility import CSVWriterThread, NpyDirectoryWriter
+
+
+def extra_frequencies(frequency):
+    """Column names suffixes of the path loss at the frequencies after the first one, when frequency is a sequence."""
+    if np.ndim(frequency) == 0:
+        return []
+    return [" {:g} MHz".format(f/1e6) for f in frequency[1:]]
+
+
+def csv_header(names, write_trajectories, frequency=None):
+    """Header of the CSV output file, for the relays in names.
+    The path loss at the first frequency has the usual columns, the other frequencies are appended after each of them."""
+    extra = extra_frequencies(frequency)
+    sat_headers = []
+    for name in names:
+        sat_headers.extend([name + ":dist (m)", name + ":path_loss (dB)", name + ":los"])
+        sat_headers.extend([name + ":path_loss" + suffix + " (dB)" for suffix in extra])
+        if write_trajectories:
+            sat_headers.extend([name+":longitude (°)", name+":latitude (°)", name+":altitude (m)"])
+    return (["time (s)", "longitude (°)", "latitude (°)", "altitude (m)"] + ["minimum_dist (m)", "minimum_name (norad id)", "path_loss (dB)"]
+            + ["path_loss" + suffix + " (dB)" for suffix in extra] + sat_headers)
+
+
+def chunk_rows(chunk, names, write_trajectories):
+    """Convert a chunk of results into CSV rows.
+    With several frequencies, the path losses at the frequencies after the first one follow the columns of the first one.
+
+    Returns:
+        list of list, [time, longitude, latitude, altitude, minimum dist, minimum name, path_loss, dist1, path_loss1, los1, ...]
+    """
+    # Path losses with a trailing frequency axis, of length 1 for a single frequency
+    path_loss = chunk["path_loss"] if chunk["path_loss"].ndim == 3 else chunk["path_loss"][..., np.newaxis]
+    minimum_path_loss = np.reshape(chunk["minimum_path_loss"], (len(chunk["time"]), -1))
+    data = []
+    for i in range(len(chunk["time"])):
+        line = [chunk["time"][i], chunk["longitude"][i], chunk["latitude"][i], chunk["altitude"][i]]
+        line.append(chunk["minimum_dist"][i])
+        line.append(names[chunk["minimum_index"][i]] if chunk["minimum_index"][i] >= 0 else "None")
+        line.extend(minimum_path_loss[i].tolist())
+        row_dists, row_los, row_losses = chunk["distance"][i].tolist(), chunk["los"][i].tolist(), path_loss[i].tolist()
+        if write_trajectories:
+            row_subpoints = chunk["relays_position"][i].tolist()
+        for j in range(len(names)):
+            losses = row_losses[j] if row_los[j] else [""] * len(row_losses[j])
+            line.extend([row_dists[j], losses[0], row_los[j]] + losses[1:])
+            if write_trajectories:
+                line.extend(row_subpoints[j])
+        data.append(line)
+    return data
+
+
+class CSVOutput(CSVWriterThread):
+    """Wide CSV output, one row per trajectory point and three (or six) columns per relay,
+    plus one column per relay for every additional frequency.
+    If compact is set, the rows are formatted before being queued, so the queued chunks take less memory."""
+
+    def __init__(self, file, names, write_trajectories, frequency=None, compact=False):
+        super().__init__(file, csv_header(names, write_trajectories, frequency))
+        self.names = names
+        self.write_trajectories = write_trajectories
+        self.compact = compact
+
+    def write(self, chunk):
+        rows = chunk_rows(chunk, self.names, self.write_trajectories)
+        if self.compact:
+            text = io.StringIO()
+            csv.writer(text, delimiter=',').writerows(rows)
+            self.write_text(text.getvalue())
+        else:
+            self.write_rows(rows)
+
+
+class NpyOutput(NpyDirectoryWriter):
+    """Columnar output, a directory with one memory-mappable .npy file per quantity.
+
+    Files (N points, M relays):
+        time, longitude, latitude, altitude, minimum_dist, minimum_path_loss: (N,) float64
+        minimum_index: (N,) int32, index in header["relays"] of the closest relay in sight, -1 if none
+        distance, path_loss: (N, M) float64, path loss is NaN when the relay is not in sight
+        With F frequencies (header["frequency"] is then a list), minimum_path_loss is (N, F) and path_loss is (N, M, F)
+        If header["compact"] is set, distance, path_loss and relays_position are float32
+        los: (N, M) bool
+        relays_position: (N, M, 3) float64 longitude (°), latitude (°), altitude (m), only with write_trajectories
+    """
+
+    def __init__(self, directory, names, points, frequency, write_trajectories, compact=False):
+        header = {"relays": list(names), "points": points, "frequency": frequency, "write_trajectories": write_trajectories, "compact": compact}
+        value = np.float32 if compact else np.float64
+        frequencies = np.shape(frequency)
+        columns = {name: ((points,), np.float64) for name in ["time", "longitude", "latitude", "altitude", "minimum_dist"]}
+        columns["minimum_path_loss"] = ((points,) + frequencies, np.float64)
+        columns["minimum_index"] = ((points,), np.int32)
+        columns["distance"] = ((points, len(names)), value)
+        columns["path_loss"] = ((points, len(names)) + frequencies, value)
+        columns["los"] = ((points, len(names)), np.bool_)
+        if write_trajectories:
+            columns["relays_position"] = ((points, len(names), 3), value)
+        super().__init__(directory, header, columns)
+
+
+def open_output(output_format, file, names, points, frequency, write_trajectories, compact=False):
+    """Returns the writer of the results in the given format, to be used as a context manager.
+    compact reduces the memory used by the chunks waiting to be written, see CSVOutput and NpyOutput."""
+    if output_format == "csv":
+        return CSVOutput(file, names, write_trajectories, frequency, compact)
+    elif output_format == "npy":
+        return NpyOutput(file, names, points, frequency, write_trajectories, compact)
+    raise RuntimeError("Unknown output format \"{}\".".format(output_format))
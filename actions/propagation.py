@@ -0,0 +1,362 @@
+from skyfield.api import EarthSatellite
+from skyfield.framelib import itrs
+from skyfield.sgp4lib import TEME
+from skyfield.toposlib import iers2010
+from sgp4.api import SatrecArray
+import collections
+import math
+import csv
+
+import numpy as np
+
+from utility import header_indexes, ArrayCache
+
+
+class Relay(EarthSatellite):
+    """A skyfield EarthSatellite that keeps the TLE lines it has been built from.
+
+    A relay can have several element sets (TLE of different epochs), in history sorted by epoch: each time is then
+    propagated with the element set of the closest epoch. The Relay itself is the element set of the latest epoch.
+    """
+
+    def __init__(self, line1, line2, name=None):
+        super().__init__(line1, line2, name)
+        self.tle = (line1, line2)
+        # UTC Epoch timestamp of the epoch of the TLE
+        self.epoch_time = (self.model.jdsatepoch - 2440587.5) * 86400.0 + self.model.jdsatepochF * 86400.0
+        self.history = [self]
+        # Times halfway between the epochs of successive element sets of history
+        self._switches = np.empty(0)
+
+    def add_element_set(self, relay):
+        """Add the element set of another Relay of the same satellite to the history, and return the relay of the
+        latest epoch, which holds the history. An element set of the same epoch as one of the history replaces it."""
+        history = {element_set.epoch_time: element_set for element_set in self.history + relay.history}
+        history = [history[epoch] for epoch in sorted(history)]
+        for element_set in history:
+            element_set.history, element_set._switches = [element_set], np.empty(0)
+        latest = history[-1]
+        latest.history = history
+        epochs = np.array([element_set.epoch_time for element_set in history])
+        latest._switches = (epochs[:-1] + epochs[1:]) / 2
+        return latest
+
+    def element_sets(self, epoch_times):
+        """(N,) indexes in history of the element set of the closest epoch to each time, by binary search."""
+        return np.searchsorted(self._switches, epoch_times)
+
+
+def make_relays(element_sets):
+    """Build the relays from their element sets.
+
+    Args:
+        element_sets: iterable of (norad_id, line1, line2), a satellite can have several element sets
+    Returns:
+        dict of norad_id -> Relay, in the order of the first element set of each satellite
+    """
+    satellites = {}
+    for name, L1, L2 in element_sets:
+        relay = Relay(L1, L2, name)
+        satellites[name] = satellites[name].add_element_set(relay) if name in satellites else relay
+    return satellites
+
+
+def load_satellites(satellites_file):
+    """Load the satellites orbits from a file containing the columns tle1, tle2 and norad_id.
+    A satellite can have several rows, one per element set (see Relay).
+
+    Returns:
+        dict of norad_id -> Relay
+    """
+    with open(satellites_file, 'r') as csvfile:
+        reader = csv.reader(csvfile, delimiter=',')
+
+        header = next(reader, None)
+        tle1_index, tle2_index, id_index = header_indexes(header, ["tle1", "tle2", "norad_id"])
+        return make_relays((row[id_index], row[tle1_index], row[tle2_index]) for row in reader)
+
+
+def utc_times(ts, epoch_times):
+    """Build one array-valued skyfield Time from UTC Epoch timestamps, keeping the fractions of second."""
+    days, seconds = np.divmod(np.asarray(epoch_times, dtype=np.float64), 86400.0)
+    return ts.utc(1970, 1, 1 + days, 0, 0, seconds)
+
+
+def geographic_positions(relays_pos):
+    """Longitude (°), latitude (°) and altitude (m) of ITRF positions given in meters, in a (..., 3) array.
+
+    Same computation as skyfield's Geocentric.subpoint(), on the IERS2010 ellipsoid.
+    """
+    x, y, z = relays_pos[..., 0], relays_pos[..., 1], relays_pos[..., 2]
+    a = iers2010.radius.m
+    f = 1.0 / iers2010.inverse_flattening
+    e2 = 2.0*f - f*f
+    R = np.sqrt(x*x + y*y)
+    lat = np.arctan2(z, R)
+    for iteration in 0, 1, 2:
+        sin_lat = np.sin(lat)
+        e2_sin_lat = e2 * sin_lat
+        aC = a / np.sqrt(1.0 - e2_sin_lat * sin_lat)
+        hyp = z + aC * e2_sin_lat
+        lat = np.arctan2(hyp, R)
+    lon = (np.arctan2(y, x) - math.pi) % math.tau - math.pi
+    height = np.sqrt(hyp * hyp + R * R) - aC
+    return np.stack([np.degrees(lon), np.degrees(lat), height], axis=-1)
+
+
+def propagate_relays(satellites, time, epoch_times, cache=None, propagator="skyfield"):
+    """Propagate every relay at every given time.
+
+    Args:
+        satellites: dict of norad_id -> Relay, each time is propagated with the element set of the closest epoch
+        time: array-valued skyfield Time
+        epoch_times: the UTC Epoch timestamps of time, used as the time grid of the cache entries
+            and to choose the element sets
+        cache: an ArrayCache where the positions are stored per (TLE, time grid), or None
+        propagator: "skyfield" to propagate the EarthSatellite objects one by one,
+            "sgp4" to propagate all the relays at once with sgp4's SatrecArray (see sgp4_positions).
+            With both, the relays changing of element set within the times are propagated with sgp4_positions.
+    Returns:
+        (N, M, 3) array of ITRF positions in meters
+    """
+    relays_pos = np.empty((len(epoch_times), len(satellites), 3))
+    time_grid = np.ascontiguousarray(epoch_times, dtype=np.float64)
+    keys = {}
+    missing = []  # Indexes of the relays that are not in the cache
+    for j, sat in enumerate(satellites.values()):
+        if cache is not None:
+            keys[j] = ArrayCache.key(*(line for element_set in sat.history for line in element_set.tle), time_grid, "itrf")
+            cached = cache.get(keys[j])
+            if cached is not None:
+                relays_pos[:, j, :] = cached
+                continue
+        missing.append(j)
+
+    # Most relays use a single element set over all the times, the others are propagated by segments of the times
+    # closest to the same epoch, the segments of the same times being propagated together
+    relays = list(satellites.values())
+    whole = {}     # Index of the relay -> element set used at every time
+    segments = {}  # Packed rows -> rows, indexes of the relays and their element sets
+    for j in missing:
+        if len(relays[j].history) == 1:
+            whole[j] = relays[j]
+            continue
+        indexes = relays[j].element_sets(time_grid)
+        if np.all(indexes == indexes[0]):
+            whole[j] = relays[j].history[indexes[0]]
+            continue
+        for k in np.unique(indexes):
+            rows = indexes == k
+            segment = segments.setdefault(np.packbits(rows).tobytes(), (rows, [], []))
+            segment[1].append(j)
+            segment[2].append(relays[j].history[k])
+
+    rotations = teme_rotations(time) if segments or (whole and propagator == "sgp4") else None
+    if propagator == "sgp4":
+        if whole:
+            relays_pos[:, list(whole), :] = sgp4_positions(list(whole.values()), time, rotations)
+    else:
+        for j, element_set in whole.items():
+            relays_pos[:, j, :] = element_set.at(time).itrf_xyz().m.T
+    for rows, columns, element_sets in segments.values():
+        rows = np.flatnonzero(rows)
+        relays_pos[rows[:, np.newaxis], columns, :] = sgp4_positions(element_sets, time[rows], rotations[rows])
+
+    if cache is not None:
+        for j in missing:
+            cache.put(keys[j], relays_pos[:, j, :])
+    return relays_pos
+
+
+def teme_rotations(time):
+    """(N, 3, 3) rotations from TEME to ITRS at the times of an array-valued skyfield Time, the same as skyfield's
+    (TEME to GCRS, then GCRS to ITRS)."""
+    return np.einsum('ijn,kjn->nik', itrs.rotation_at(time), TEME.rotation_at(time))
+
+
+def sgp4_positions(relays, time, rotations=None):
+    """Propagate all the relays at all the times with a single call to sgp4's SatrecArray.
+
+    The TEME positions are rotated to ITRF with the same rotations as skyfield, computed once per time instead
+    of once per relay and time.
+
+    Args:
+        relays: list of Relay (or any skyfield EarthSatellite)
+        time: array-valued skyfield Time
+        rotations: the teme_rotations of time if they are already computed, or None
+    Returns:
+        (N, M, 3) array of ITRF positions in meters, NaN where SGP4 failed
+    """
+    # Same time arguments as skyfield, the TLE epochs are UTC dates
+    fraction = time.tai_fraction - time._leap_seconds() / 86400.0
+    errors, positions, velocities = SatrecArray([relay.model for relay in relays]).sgp4(time.whole, fraction)
+    positions[errors != 0] = np.nan
+
+    if rotations is None:
+        rotations = teme_rotations(time)
+    return np.matmul(positions.transpose(1, 0, 2), rotations.transpose(0, 2, 1)) * 1000.0
+
+
+# Number of grid points used by the Lagrange interpolation of the relays positions
+LAGRANGE_POINTS = 8
+# Number of points where the interpolation is checked against the exact propagation, in each chunk
+INTERPOLATION_CHECKS = 16
+
+
+def _lagrange_weights(times, start, step, count):
+    """Lagrange interpolation weights of times on the uniform grid start + k*step, k < count.
+
+    Returns:
+        (N,) array of the first grid point used for each time, and (N, LAGRANGE_POINTS) array of weights
+    """
+    x = (times - start) / step
+    first = np.clip(np.floor(x).astype(int) - LAGRANGE_POINTS//2 + 1, 0, count - LAGRANGE_POINTS)
+    diff = (x - first)[:, np.newaxis] - np.arange(LAGRANGE_POINTS)
+    weights = np.ones((len(times), LAGRANGE_POINTS))
+    for k in range(LAGRANGE_POINTS):
+        for j in range(LAGRANGE_POINTS):
+            if j != k:
+                weights[:, j] *= diff[:, k] / (j - k)
+    return first, weights
+
+
+def _interpolate(grid_pos, first, weights):
+    nodes = grid_pos[first[:, np.newaxis] + np.arange(LAGRANGE_POINTS)]
+    return np.einsum('np,npmk->nmk', weights, nodes)
+
+
+def _propagate_switches(satellites, ts, times, relays_pos, first, start, step, propagator):
+    """Replace the interpolated positions of relays_pos whose grid points are not all propagated with the same element
+    set, around the switches between the element sets of a relay, by exact positions.
+
+    Returns:
+        the number of positions replaced
+    """
+    replaced = 0
+    low = start + first * step
+    high = low + (LAGRANGE_POINTS - 1) * step
+    for index, (name, relay) in enumerate(satellites.items()):
+        if len(relay.history) > 1:
+            rows = np.flatnonzero(relay.element_sets(low) != relay.element_sets(high))
+            if len(rows):
+                relays_pos[rows, index] = propagate_relays({name: relay}, utc_times(ts, times[rows]), times[rows],
+                                                           propagator=propagator)[:, 0]
+                replaced += len(rows)
+    return replaced
+
+
+def interpolate_relays(satellites, ts, epoch_times, step, max_error, stats, cache=None, propagator="skyfield"):
+    """Propagate every relay on a coarse grid and interpolate the positions at every given time.
+
+    The grid points are multiples of step seconds, so that they can be shared through the cache.
+    The interpolation is checked against the exact positions in the middle of some grid intervals, where the error
+    is the largest. If the error is above max_error, step is halved, down to an exact propagation.
+    A position is not interpolated between grid points propagated with different element sets of a relay (see Relay):
+    it is propagated exactly.
+
+    Args:
+        satellites: dict of norad_id -> Relay
+        ts: skyfield timescale
+        epoch_times: the UTC Epoch timestamps of the trajectory
+        step: the initial grid step, in seconds
+        max_error: the maximum position error allowed, in meters
+        stats: dict updated with the achieved error ("interpolation_error_max") and step ("interpolation_step_min"),
+            and the number of positions propagated exactly around the switches of element sets ("interpolation_exact_points")
+        cache: an ArrayCache for the positions on the grid, or None
+        propagator: see propagate_relays
+    Returns:
+        (N, M, 3) array of ITRF positions in meters
+    """
+    times = np.asarray(epoch_times, dtype=np.float64)
+    step = int(step)
+    while step >= 2:
+        first_node = math.floor(times.min() / step) - LAGRANGE_POINTS//2
+        count = math.ceil(times.max() / step) + LAGRANGE_POINTS//2 - first_node + 1
+        start = first_node * step
+        grid = start + step * np.arange(count, dtype=np.float64)
+        grid_pos = propagate_relays(satellites, utc_times(ts, grid), grid, cache, propagator)
+
+        # Check the middle of some of the grid intervals spanned by the trajectory
+        intervals = grid[(grid >= times.min() - step) & (grid <= times.max())]
+        checks = intervals[np.unique(np.linspace(0, len(intervals)-1, INTERPOLATION_CHECKS).astype(int))] + step/2
+        exact = propagate_relays(satellites, utc_times(ts, checks), checks, propagator=propagator)
+        first, weights = _lagrange_weights(checks, start, step, count)
+        checked = _interpolate(grid_pos, first, weights)
+        _propagate_switches(satellites, ts, checks, checked, first, start, step, propagator)
+        error = np.max(np.linalg.norm(checked - exact, axis=-1))
+        if error <= max_error:
+            first, weights = _lagrange_weights(times, start, step, count)
+            relays_pos = _interpolate(grid_pos, first, weights)
+            replaced = _propagate_switches(satellites, ts, times, relays_pos, first, start, step, propagator)
+            stats["interpolation_error_max"] = max(stats.get("interpolation_error_max", 0.0), float(error))
+            stats["interpolation_step_min"] = min(stats.get("interpolation_step_min", step), step)
+            stats["interpolation_exact_points"] = stats.get("interpolation_exact_points", 0) + replaced
+            return relays_pos
+        step //= 2
+
+    # The orbits cannot be interpolated with the required accuracy
+    stats["interpolation_error_max"] = max(stats.get("interpolation_error_max", 0.0), 0.0)
+    stats["interpolation_step_min"] = 1
+    return propagate_relays(satellites, utc_times(ts, epoch_times), epoch_times, cache, propagator)
+
+
+def relays_positions(satellites, ts, epoch_times, cache=None, interpolation=None, propagator="skyfield", stats=None):
+    """Positions of every relay at every given time, propagated or interpolated.
+
+    Args:
+        satellites: dict of norad_id -> Relay
+        ts: skyfield timescale
+        epoch_times: the UTC Epoch timestamps
+        cache: see propagate_relays
+        interpolation: None to propagate at every time, or a (step, max_error) tuple, see interpolate_relays
+        propagator: see propagate_relays
+        stats: dict updated with the interpolation statistics, or None
+    Returns:
+        (N, M, 3) array of ITRF positions in meters
+    """
+    if interpolation is not None:
+        return interpolate_relays(satellites, ts, epoch_times, *interpolation, stats if stats is not None else {}, cache, propagator)
+    return propagate_relays(satellites, utc_times(ts, epoch_times), epoch_times, cache, propagator)
+
+
+class Ephemeris:
+    """Positions of the relays over a fixed set of times, propagated block by block the first time they are needed.
+
+    Several trajectories can share the same Ephemeris: the relays are propagated only once at the times they have in common.
+    At most max_memory bytes of blocks are kept, the least recently used blocks are dropped and propagated again if needed.
+    The other arguments are the ones of relays_positions.
+    """
+
+    def __init__(self, satellites, ts, times, block_size, max_memory, cache=None, interpolation=None, propagator="skyfield", stats=None):
+        self.satellites = satellites
+        self.ts = ts
+        self.times = np.unique(times)
+        self.block_size = block_size
+        self.max_blocks = max(1, int(max_memory // (block_size * max(len(satellites), 1) * 3 * 8)))
+        self.options = {"cache": cache, "interpolation": interpolation, "propagator": propagator, "stats": stats}
+        self._blocks = collections.OrderedDict()
+
+    def positions(self, epoch_times):
+        """(N, M, 3) array of ITRF positions in meters at the given times, which must be part of the times of the Ephemeris."""
+        indexes = np.searchsorted(self.times, epoch_times)
+        if np.any(indexes >= len(self.times)) or np.any(self.times[np.minimum(indexes, len(self.times)-1)] != epoch_times):
+            raise ValueError("The ephemeris does not cover the requested times.")
+
+        relays_pos = np.empty((len(epoch_times), len(self.satellites), 3))
+        blocks = indexes // self.block_size
+        for block in np.unique(blocks):
+            rows = blocks == block
+            relays_pos[rows] = self._block(block)[indexes[rows] - block*self.block_size]
+        return relays_pos
+
+    def _block(self, block):
+        if block in self._blocks:
+            self._blocks.move_to_end(block)
+            return self._blocks[block]
+
+        times = self.times[block*self.block_size:(block+1)*self.block_size]
+        positions = relays_positions(self.satellites, self.ts, times, **self.options)
+        self._blocks[block] = positions
+        while len(self._blocks) > self.max_blocks:
+            self._blocks.popitem(last=False)
+        return positions
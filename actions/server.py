@@ -0,0 +1,227 @@
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import socketserver
+import collections
+import threading
+import urllib.parse
+import json
+import io
+import os
+import csv
+
+import numpy as np
+
+from .api import timescale, compute_attenuation
+from .output import csv_header, chunk_rows
+from .propagation import load_satellites, utc_times, propagate_relays
+from .trajectory import read_trajectory
+
+
+# Memory used to keep the relays positions of the recent queries, in bytes
+RECENT_POSITIONS_MEMORY = 64 * 1024**2
+# Largest request body accepted, in bytes
+MAX_REQUEST_SIZE = 256 * 1024**2
+
+
+class RecentPositions:
+    """Relays positions at the most recently queried times, shared by the requests.
+
+    It has the positions() method of actions.propagation.Ephemeris, so attenuation_chunk can use it as an ephemeris.
+    The positions at the times that are not known yet are propagated, the least recently used times are dropped
+    when more than max_memory bytes are used. They are not written to the disk cache (utility.ArrayCache): its
+    entries are keyed by the whole time grid, which the queries seldom repeat.
+    """
+
+    def __init__(self, satellites, ts, max_memory, propagator="skyfield"):
+        self.satellites = satellites
+        self.ts = ts
+        self.max_times = max(1, int(max_memory // (len(satellites) * 3 * 8)))
+        self.propagator = propagator
+        self.hits = 0
+        self.misses = 0
+        self._positions = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def positions(self, epoch_times):
+        """(N, M, 3) array of ITRF positions in meters at the given times."""
+        relays_pos = np.empty((len(epoch_times), len(self.satellites), 3))
+        missing = []
+        with self._lock:
+            for i, time in enumerate(epoch_times.tolist()):
+                if time in self._positions:
+                    self._positions.move_to_end(time)
+                    relays_pos[i] = self._positions[time]
+                else:
+                    missing.append(i)
+            self.hits += len(epoch_times) - len(missing)
+            self.misses += len(missing)
+
+        if missing:
+            times = epoch_times[missing]
+            relays_pos[missing] = propagate_relays(self.satellites, utc_times(self.ts, times), times, propagator=self.propagator)
+            with self._lock:
+                for time, position in zip(times.tolist(), relays_pos[missing]):
+                    self._positions[time] = position
+                while len(self._positions) > self.max_times:
+                    self._positions.popitem(last=False)
+        return relays_pos
+
+
+class AttenuationService:
+    """The warm state of the server: the relays, the timescale and the recent relays positions."""
+
+    def __init__(self, satellites, frequency, propagator="skyfield", chunk_size=1000):
+        self.satellites = satellites
+        self.frequency = frequency
+        self.chunk_size = chunk_size
+        self.positions = RecentPositions(satellites, timescale(), RECENT_POSITIONS_MEMORY, propagator)
+
+    def compute(self, times, longitudes, latitudes, altitudes, frequency=None, write_trajectories=False):
+        """Same as actions.api.compute_attenuation, a single point can be given as numbers. Returns the dict of the arrays."""
+        result = compute_attenuation(np.atleast_1d(np.asarray(times, dtype=np.float64)), longitudes, latitudes, altitudes,
+                                     self.satellites, self.frequency if frequency is None else frequency, write_trajectories,
+                                     self.chunk_size, ephemeris=self.positions)
+        return result.arrays()
+
+
+def _json_array(array):
+    """List of the values, with null for NaN and infinite values which JSON does not have."""
+    if array.dtype.kind == 'f':
+        return np.where(np.isfinite(array), array, None).tolist()
+    return array.tolist()
+
+
+class QueryHandler(BaseHTTPRequestHandler):
+    """HTTP interface of an AttenuationService (self.server.service).
+
+    GET /relays: the names of the relays.
+    POST /attenuation: JSON object with time (UTC Epoch timestamp), longitude, latitude, altitude, either numbers
+        for a single point or lists for a batch of points, and optionally frequency and write_trajectories.
+    POST /trajectory?time=T[&frequency=F][&format=csv]: a trajectory file in the body, its times are relative to T.
+    The answer is a JSON object with the relays and the arrays described in actions.api.Attenuation, or the CSV output.
+    """
+
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        if urllib.parse.urlsplit(self.path).path == "/relays":
+            self._send_json({"relays": list(self.server.service.satellites)})
+        else:
+            self._send_error(404, "Unknown path \"{}\".".format(self.path))
+
+    def do_POST(self):
+        url = urllib.parse.urlsplit(self.path)
+        query = urllib.parse.parse_qs(url.query)
+        try:
+            body = self._read_body()
+            if url.path == "/attenuation":
+                request = json.loads(body)
+                if not isinstance(request, dict):
+                    raise ValueError("The body must be a JSON object")
+                frequency = request.get("frequency", self.server.service.frequency)
+                arrays = self.server.service.compute(request["time"], request["longitude"], request["latitude"], request["altitude"],
+                                                     frequency, bool(request.get("write_trajectories", False)))
+                self._send_result(arrays, request.get("format", "json"), frequency)
+            elif url.path == "/trajectory":
+                altitudes, longitudes, latitudes, rela_times = read_trajectory(io.StringIO(body.decode()))
+                frequency = [float(f) for f in query["frequency"]] if "frequency" in query else self.server.service.frequency
+                frequency = frequency[0] if np.ndim(frequency) == 1 and len(frequency) == 1 else frequency
+                arrays = self.server.service.compute(float(query.get("time", ["0"])[0]) + rela_times, longitudes, latitudes, altitudes,
+                                                     frequency, query.get("write_trajectories", ["0"])[0] == "1")
+                self._send_result(arrays, query.get("format", ["json"])[0], frequency)
+            else:
+                self._send_error(404, "Unknown path \"{}\".".format(self.path))
+        except (RuntimeError, ValueError, KeyError, TypeError) as E:
+            self._send_error(400, "Invalid request ({}: {}).".format(type(E).__name__, E))
+
+    def _read_body(self):
+        length = int(self.headers.get("Content-Length", 0))
+        if length > MAX_REQUEST_SIZE:
+            raise RuntimeError("The request is larger than {} bytes".format(MAX_REQUEST_SIZE))
+        return self.rfile.read(length)
+
+    def _send_result(self, arrays, output_format, frequency):
+        names = list(self.server.service.satellites)
+        if output_format == "csv":
+            text = io.StringIO()
+            spamwriter = csv.writer(text, delimiter=',')
+            spamwriter.writerow(csv_header(names, "relays_position" in arrays, frequency))
+            spamwriter.writerows(chunk_rows(arrays, names, "relays_position" in arrays))
+            self._send(200, text.getvalue().encode(), "text/csv")
+        else:
+            result = {key: _json_array(value) for key, value in arrays.items()}
+            result["relays"] = names
+            result["best_relay"] = [names[i] if i >= 0 else None for i in arrays["minimum_index"].tolist()]
+            self._send_json(result)
+
+    def _send_json(self, value, status=200):
+        self._send(status, json.dumps(value).encode(), "application/json")
+
+    def _send_error(self, status, message):
+        self._send_json({"error": message}, status)
+
+    def _send(self, status, data, content_type):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def address_string(self):
+        # Clients of a Unix socket have no address
+        return self.client_address[0] if isinstance(self.client_address, tuple) and self.client_address else "local"
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+
+class UnixHTTPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    """ThreadingHTTPServer listening on a Unix socket."""
+    daemon_threads = True
+
+
+def create_server(address, service, verbose=False):
+    """HTTP server of the service, address is HOST:PORT or the path of a Unix socket (containing a "/" or ending with .sock)."""
+    if "/" in address or address.endswith(".sock"):
+        if not hasattr(socketserver, "UnixStreamServer"):
+            raise RuntimeError("Unix sockets are not available on this platform.")
+        if os.path.exists(address):
+            os.remove(address)
+        server = UnixHTTPServer(address, QueryHandler)
+    else:
+        host, _, port = address.rpartition(":")
+        try:
+            server = ThreadingHTTPServer((host or "127.0.0.1", int(port)), QueryHandler)
+        except ValueError:
+            raise RuntimeError("Invalid address \"{}\", expected HOST:PORT or the path of a Unix socket.".format(address))
+    server.service = service
+    server.verbose = verbose
+    return server
+
+
+def serve(context):
+    """Answer attenuation queries until interrupted, see QueryHandler.
+
+    Args (context):
+        serve_address: HOST:PORT or the path of a Unix socket.
+        tle_file: the file containing the TLE of the relays, see actions.propagation.load_satellites.
+        frequency: the default frequency of the queries, in hertz.
+        propagator: see actions.propagation.propagate_relays.
+        chunk_size: number of points calculated at once.
+    """
+    satellites = load_satellites(context.tle_file)
+    if not satellites:
+        raise RuntimeError("No relay in \"{}\".".format(context.tle_file))
+    service = AttenuationService(satellites, context.frequency, context.propagator, context.chunk_size)
+    server = create_server(context.serve_address, service)
+
+    print("Serving {} relays on {} (Ctrl+C to stop)".format(len(satellites), context.serve_address))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        if isinstance(server, UnixHTTPServer) and os.path.exists(context.serve_address):
+            os.remove(context.serve_address)
+    print("Recent positions: {} hits, {} misses".format(service.positions.hits, service.positions.misses))
@@ -0,0 +1,92 @@
+import calendar
+import bisect
+import os.path
+import time
+import csv
+
+from utility import header_indexes
+
+
+# A TLE fetched less than this number of seconds ago is not fetched again, even if its epoch is old:
+# the tracking website would give the same one
+MIN_REFETCH_INTERVAL = 6 * 3600
+# Default age, relative to the latest TLE of a satellite, of the oldest TLE kept in the store, in seconds
+HISTORY_AGE = 30 * 86400
+
+
+def tle_epoch(line1):
+    """UTC Epoch timestamp of the epoch of a TLE, read from its first line (columns 19 to 32, YYDDD.DDDDDDDD)."""
+    try:
+        year, day = int(line1[18:20]), float(line1[20:32])
+    except ValueError:
+        raise RuntimeError("Invalid TLE line \"{}\"".format(line1))
+    year += 2000 if year < 57 else 1900
+    return calendar.timegm((year, 1, 1, 0, 0, 0)) + (day - 1) * 86400
+
+
+class TLEStore:
+    """Persistent store of the TLE of every satellite, in a CSV file.
+
+    The store keeps the history of the TLE of each satellite: every TLE of a new epoch is added to the ones
+    fetched before, so that past times can be calculated with the TLE of the closest epoch (see actions.propagation.Relay).
+    The TLE whose epoch is older than the latest one by more than history_age seconds are dropped, to bound the size of
+    the store and the number of element sets of the relays.
+    Every entry is the two lines of the TLE, the epoch of the TLE and the time it has been fetched at
+    (UTC Epoch timestamps), keyed by norad id and sorted by epoch.
+    """
+
+    COLUMNS = ["norad_id", "tle1", "tle2", "epoch", "fetched"]
+
+    def __init__(self, file, history_age=HISTORY_AGE):
+        self.file = file
+        self.history_age = history_age
+        self.entries = {}  # norad_id -> list of [tle1, tle2, epoch, fetched], sorted by epoch
+        if os.path.isfile(file):
+            with open(file, 'r') as csvfile:
+                reader = csv.reader(csvfile, delimiter=',')
+                indexes = header_indexes(next(reader, None), self.COLUMNS)
+                for row in reader:
+                    norad_id, tle1, tle2, epoch, fetched = (row[i] for i in indexes)
+                    self.put(norad_id, tle1, tle2, float(fetched))
+
+    def get(self, norad_id):
+        """The two lines of the latest TLE of the satellite, or None if it is not in the store."""
+        entries = self.entries.get(norad_id)
+        return entries[-1][:2] if entries else None
+
+    def history(self, norad_id):
+        """List of the two lines of every TLE of the satellite, sorted by epoch (empty if it is not in the store)."""
+        return [entry[:2] for entry in self.entries.get(norad_id, [])]
+
+    def put(self, norad_id, tle1, tle2, fetched=None):
+        """Add a TLE to the history of the satellite, it replaces the TLE of the same epoch if there is one."""
+        entry = [tle1, tle2, tle_epoch(tle1), time.time() if fetched is None else fetched]
+        entries = self.entries.setdefault(norad_id, [])
+        index = bisect.bisect_left([e[2] for e in entries], entry[2])
+        if index < len(entries) and entries[index][2] == entry[2]:
+            entries[index] = entry
+        else:
+            entries.insert(index, entry)
+        while entries[-1][2] - entries[0][2] > self.history_age:
+            entries.pop(0)
+
+    def is_fresh(self, norad_id, max_age, now=None):
+        """Whether or not the satellite is in the store and the epoch of its latest TLE is less than max_age seconds old,
+        or it has been fetched less than MIN_REFETCH_INTERVAL seconds ago."""
+        entries = self.entries.get(norad_id)
+        if not entries:
+            return False
+        now = time.time() if now is None else now
+        fetched = max(entry[3] for entry in entries)
+        return now - entries[-1][2] <= max_age or now - fetched < min(MIN_REFETCH_INTERVAL, max_age)
+
+    def save(self):
+        """Write the store, through a temporary file so an interrupted run does not lose it."""
+        temporary = "{}.{}.tmp".format(self.file, os.getpid())
+        with open(temporary, 'w', newline='') as csvfile:
+            spamwriter = csv.writer(csvfile, delimiter=',')
+            spamwriter.writerow(self.COLUMNS)
+            for norad_id, entries in self.entries.items():
+                for entry in entries:
+                    spamwriter.writerow([norad_id] + entry)
+        os.replace(temporary, self.file)
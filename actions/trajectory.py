@@ -1,19 +1,35 @@
-from skyfield.api import Loader, EarthSatellite, Topos
-from skyfield.functions import length_of
-import datetime
+from skyfield.api import Loader, Topos
+import concurrent.futures
+import collections
+import glob
+import itertools
+import io
 import os.path
 import math
 import csv
 
 import numpy as np
 
-from utility import confirmation, header_indexes
+from utility import confirmation, header_indexes, ArrayCache, timed, current_memory, peak_memory
+
+from .output import open_output, extra_frequencies
+from .propagation import make_relays, load_satellites, utc_times, relays_positions, geographic_positions, Ephemeris
+
+
+# Semi-axes of the Earth ellipsoid used for the line of sight, in meters
+EARTH_EQUATORIAL_RADIUS = 6371008.7714
+EARTH_POLAR_RADIUS = 6356752.314245
 
 
 def path_loss(frequency, dist):
-    """Returns the path loss (in dB) given a frequency and a distance."""
+    """Returns the path loss (in dB) given a frequency and a distance.
+    dist can be a number or a numpy array of distances.
+    frequency can also be a sequence of F frequencies, the result then has an additional last axis of length F:
+    the logarithm of the distances is computed once for all the frequencies."""
 
-    return 20*math.log10(4*math.pi*dist*frequency/299792458)
+    if np.ndim(frequency) == 0:
+        return 20*np.log10(4*np.pi*dist*frequency/299792458)
+    return np.add.outer(20*np.log10(dist), 20*np.log10(4*np.pi*np.asarray(frequency)/299792458))
 
 
 def los_to_earth(position, pointing):
@@ -22,61 +38,478 @@ def los_to_earth(position, pointing):
 
     Finds the intersection of a pointing vector u and starting point s with the WGS-84 geoid
     Args:
-        position : length 3 array defining the starting point location(s) in meters
-        pointing : length 3 array defining the pointing vector(s) (must be a unit vector)
+        position : (..., 3) array defining the starting point location(s) in meters
+        pointing : (..., 3) array defining the pointing vector(s) (must be unit vectors)
     Returns:
-        bool: wheter or not the ray (position, pointing) intersects the Earth
+        bool array: wheter or not each ray (position, pointing) intersects the Earth
     """
 
-    a = 6371008.7714
-    b = 6371008.7714
-    c = 6356752.314245
-    x = position[0]
-    y = position[1]
-    z = position[2]
-    u = pointing[0]
-    v = pointing[1]
-    w = pointing[2]
+    a = EARTH_EQUATORIAL_RADIUS
+    b = EARTH_EQUATORIAL_RADIUS
+    c = EARTH_POLAR_RADIUS
+    x = position[..., 0]
+    y = position[..., 1]
+    z = position[..., 2]
+    u = pointing[..., 0]
+    v = pointing[..., 1]
+    w = pointing[..., 2]
 
     value = -a**2*b**2*w*z - a**2*c**2*v*y - b**2*c**2*u*x
     radical = a**2*b**2*w**2 + a**2*c**2*v**2 - a**2*v**2*z**2 + 2*a**2*v*w*y*z - a**2*w**2*y**2 + b**2*c**2*u**2 - b**2*u**2*z**2 + 2*b**2*u*w*x*z - b**2*w**2*x**2 - c**2*u**2*y**2 + 2*c**2*u*v*x*y - c**2*v**2*x**2
     magnitude = a**2*b**2*w**2 + a**2*c**2*v**2 + b**2*c**2*u**2
 
-    if radical < 0:
-        return False
-    d = (value - a*b*c*np.sqrt(radical)) / magnitude
-    return d > 0
+    d = (value - a*b*c*np.sqrt(np.maximum(radical, 0))) / magnitude
+    return (radical >= 0) & (d > 0)
 
 
-def line_of_sight(pos_sat, pos_relay):
+def line_of_sight(sat_pos, relay_pos):
     """Return wheter or not the two satellites are in light of sight.
 
     This assumes that the satellites is always closer to the Earth than the relay.
     See https://medium.com/@stephenhartzell/satellite-line-of-sight-intersection-with-earth-d786b4a6a9b6.
 
     Args:
-        pos_sat: a skyfield Geocentric object
-        pos_relay: a skyfield Geocentric object
+        sat_pos: (..., 3) array, ITRF position(s) of the satellite in meters
+        relay_pos: (..., 3) array, ITRF position(s) of the relay in meters
     """
-    sat_pos = np.array(pos_sat.itrf_xyz().m)
-    relay_pos = np.array(pos_relay.itrf_xyz().m)
-
     pointing = relay_pos - sat_pos
-    norm = np.linalg.norm(pointing)
+    norm = np.linalg.norm(pointing, axis=-1, keepdims=True)
     pointing = pointing / norm
-    return not los_to_earth(sat_pos, pointing)
+    return ~los_to_earth(sat_pos, pointing)
+
+
+def hidden_by_horizon(position, pointing):
+    """Cheap and conservative version of los_to_earth, using the sphere inscribed in the Earth ellipsoid.
+
+    A ray starting outside the ellipsoid that goes through the inscribed sphere is certainly stopped by the Earth,
+    so every ray for which this returns True also intersects the Earth according to los_to_earth.
+    Only dot products are needed, pointing does not have to be a unit vector.
+
+    Args:
+        position : (..., 3) array defining the starting point location(s) in meters
+        pointing : (..., 3) array defining the pointing vector(s)
+    Returns:
+        bool array: True where the ray certainly intersects the Earth
+    """
+    position_2 = np.einsum('...i,...i->...', position, position)
+    pointing_2 = np.einsum('...i,...i->...', pointing, pointing)
+    towards = np.einsum('...i,...i->...', position, pointing)
+    # Squared distance between the center of the Earth and the ray, times |pointing|²
+    closest_2 = position_2*pointing_2 - towards*towards
+    # The margin keeps the test conservative despite rounding errors
+    radius_2 = (EARTH_POLAR_RADIUS * (1 - 1e-9))**2
+    return (position_2 > EARTH_EQUATORIAL_RADIUS**2) & (towards < 0) & (closest_2 < radius_2*pointing_2)
+
+
+def attenuation(target_pos, relays_pos, frequency, stats=None):
+    """Distance, line of sight and path loss between a target and every relay, for every point.
+
+    Relays hidden by the horizon according to hidden_by_horizon are pruned before the exact line of sight test,
+    their number is added to stats["culled"] if stats (a dict) is given, as well as the time of the path loss (see utility.timed).
+
+    Args:
+        target_pos: (N, 3) array, ITRF positions of the target in meters
+        relays_pos: (N, M, 3) array, ITRF positions of the M relays in meters
+        frequency: the frequency, in hertz, of the carrier, or a sequence of F frequencies
+    Returns:
+        three (N, M) arrays: distance (m, NaN where the relay position is NaN), line of sight mask and path loss
+        (dB, NaN when not in line of sight).
+        With F frequencies the path loss is a (N, M, F) array.
+    """
+    target_pos = np.broadcast_to(target_pos[:, np.newaxis, :], relays_pos.shape)
+    pointing = relays_pos - target_pos
+    dist = np.linalg.norm(pointing, axis=-1)
+
+    candidates = ~hidden_by_horizon(target_pos, pointing)
+    los = np.zeros(dist.shape, dtype=bool)
+    los[candidates] = ~los_to_earth(target_pos[candidates], pointing[candidates] / dist[candidates][:, np.newaxis])
+    # The relays whose propagation failed (NaN positions) are not in sight
+    los &= np.isfinite(dist)
+    losses = np.full(dist.shape + np.shape(frequency), np.nan)
+    with timed(stats, "path_loss", len(dist)):
+        losses[los] = path_loss(frequency, dist[los])
+
+    if stats is not None:
+        stats["culled"] = stats.get("culled", 0) + int(candidates.size - np.count_nonzero(candidates))
+    return dist, los, losses
+
+
+# Number of rows of the trajectory file converted at once
+TRAJECTORY_BLOCK = 1 << 18
+
+
+def read_trajectory(trajectory_file):
+    """Read the whole trajectory file, given by its path or as a text file object.
+
+    The file is read by blocks of TRAJECTORY_BLOCK rows, and each block is converted by numpy in a single call.
+    Values can use a decimal point, or a decimal comma in a quoted field (e.g. "-0,037").
+
+    Returns:
+        four numpy arrays: altitude (m), longitude (°), latitude (°) and relative time (s)
+    """
+    if not hasattr(trajectory_file, "readline"):
+        with open(trajectory_file, 'r') as file:
+            return read_trajectory(file)
+
+    file = trajectory_file
+    blocks = []
+    header = next(csv.reader([file.readline()], delimiter=',', quotechar='\"'), None) or None
+    indexes = header_indexes(header, ["altitude", "longitude", "latitude", "time"])
+
+    while True:
+        lines = list(itertools.islice(file, TRAJECTORY_BLOCK))
+        if not lines:
+            break
+        text = "".join(lines)
+        if not text.strip():
+            continue
+        blocks.append(parse_block(text, indexes))
+
+    values = np.concatenate(blocks) if blocks else np.empty((0, 4))
+    return tuple(values[:, i] for i in range(4))
+
+
+def parse_block(text, indexes):
+    """Convert CSV text into a (rows, len(indexes)) array of floats, with the columns at the given indexes."""
+    if '"' in text:
+        # Quoted fields are at odd positions, their commas are decimal separators
+        parts = text.split('"')
+        parts[1::2] = [part.replace(',', '.') for part in parts[1::2]]
+        text = "".join(parts)
+    try:
+        return np.loadtxt(io.StringIO(text), delimiter=',', usecols=indexes, ndmin=2)
+    except ValueError as e:
+        raise RuntimeError("Ill-formed trajectory file ({}).".format(e))
+
+
+def attenuation_chunk(satellites, ts, epoch_times, longitudes, latitudes, altitudes, frequency, write_trajectories,
+                      cache=None, interpolation=None, propagator="skyfield", stats=None, ephemeris=None, adaptive=None, compact=False):
+    """Calculate the attenuation for a part of the trajectory.
+    If adaptive is a path loss tolerance in dB, only some points are calculated, see adaptive_chunk.
+    The relays positions are taken from ephemeris (an actions.propagation.Ephemeris) if it is given.
+    Otherwise they are read from cache (an ArrayCache) when they have already been calculated.
+    If interpolation is a (step, max_error) tuple, the relays positions are interpolated from a coarse grid
+    (see actions.propagation.interpolate_relays).
+    propagator selects how the relays are propagated, see actions.propagation.propagate_relays.
+    stats (a dict) is updated with the interpolation error and the number of relays pruned by the horizon test.
+    If compact is set, the (N, M) results and the relays positions are returned as float32.
+
+    Returns:
+        dict of numpy arrays, see actions.output.NpyOutput for the keys and shapes
+    """
+    if adaptive is not None:
+        def evaluate(rows):
+            return attenuation_chunk(satellites, ts, epoch_times[rows], longitudes[rows], latitudes[rows], altitudes[rows], frequency,
+                                     write_trajectories, cache, interpolation, propagator, stats, ephemeris, compact=compact)
+        return adaptive_chunk(evaluate, epoch_times, longitudes, latitudes, altitudes, frequency, adaptive, stats)
+
+    with timed(stats, "target_position", len(epoch_times)):
+        time = utc_times(ts, epoch_times)
+        pos = Topos(longitude_degrees=longitudes, latitude_degrees=latitudes, elevation_m=altitudes).at(time)
+        pos_xyz = pos.itrf_xyz().m.T
+
+    # Propagate every relay over the whole trajectory
+    with timed(stats, "propagation", len(epoch_times)):
+        if ephemeris is not None:
+            relays_pos = ephemeris.positions(epoch_times)
+        else:
+            relays_pos = relays_positions(satellites, ts, epoch_times, cache, interpolation, propagator, stats)
+
+    # Calculate attenuation at each point of the trajectory
+    with timed(stats, "line_of_sight", len(epoch_times)):
+        dists, los, losses = attenuation(pos_xyz, relays_pos, frequency, stats)
+    visible_dists = np.where(los, dists, math.inf)
+    min_indexes = np.argmin(visible_dists, axis=1)
+    min_dists = visible_dists[np.arange(len(epoch_times)), min_indexes]
+
+    chunk = {
+        "time": epoch_times,
+        "longitude": longitudes,
+        "latitude": latitudes,
+        "altitude": altitudes,
+        "minimum_dist": min_dists,
+        "minimum_index": np.where(min_dists < math.inf, min_indexes, -1),
+        "minimum_path_loss": path_loss(frequency, min_dists),
+        "distance": dists,
+        "path_loss": losses,
+        "los": los
+    }
+    if write_trajectories:
+        with timed(stats, "subpoints", len(epoch_times)):
+            chunk["relays_position"] = geographic_positions(relays_pos)
+    if compact:
+        # Meters and hundredths of dB are well within the precision of float32
+        for key in ("distance", "path_loss", "relays_position"):
+            if key in chunk:
+                chunk[key] = chunk[key].astype(np.float32)
+    return chunk
+
+
+# Number of points between two calculated points in the first pass of adaptive_chunk
+ADAPTIVE_STRIDE = 32
+
+
+def adaptive_chunk(evaluate, epoch_times, longitudes, latitudes, altitudes, frequency, tolerance, stats=None):
+    """Calculate a part of the trajectory at a subset of its points, and interpolate the others.
+
+    One point every ADAPTIVE_STRIDE is calculated first. Each interval between two calculated points is then checked at its thirds:
+    if the relays in sight and the closest relay are the same at both ends and at the thirds, and if the path losses interpolated
+    at the thirds are within tolerance (dB) of the calculated ones, the points of the interval are interpolated.
+    Otherwise the interval is split in three. So points are only calculated around the changes of line of sight and of closest relay.
+    The number of calculated points is added to stats["adaptive_evaluated"] if stats (a dict) is given.
+
+    Args:
+        evaluate: function returning the chunk (see attenuation_chunk) at the given indexes of points
+    Returns:
+        the chunk of all the points, see attenuation_chunk
+    """
+    count = len(epoch_times)
+    rows = np.unique(np.append(np.arange(0, count, ADAPTIVE_STRIDE), count - 1))
+    initial = evaluate(rows)
+    chunk = {key: np.empty((count,) + value.shape[1:], dtype=value.dtype) for key, value in initial.items()}
+    known = np.zeros(count, dtype=bool)  # Points already calculated
+
+    def store(rows, part):
+        for key, value in part.items():
+            chunk[key][rows] = value
+        known[rows] = True
+
+    store(rows, initial)
+    evaluated = len(rows)
+    low, high = rows[:-1], rows[1:]
+    while len(low):
+        wide = high - low > 1
+        low, high = low[wide], high[wide]
+        if not len(low):
+            break
+        # Check at two points: the error of a linear interpolation cancels out at the middle when the curve has an inflection
+        first, second = low + (high - low) // 3, low + 2 * (high - low) // 3
+        checked = np.unique(np.concatenate([first, second]))
+        # With high - low == 2, first is low itself
+        checked = checked[~known[checked]]
+        if len(checked):
+            store(checked, evaluate(checked))
+            evaluated += len(checked)
+
+        # Compare the interpolated and calculated path losses, for the relays in sight
+        los, indexes = chunk["los"], chunk["minimum_index"]
+        accepted = np.all(los[low] == los[high], axis=1) & (indexes[low] == indexes[high])
+        for rows in first, second:
+            dist = _interpolate_rows(chunk["distance"], epoch_times, low, high, rows)
+            error = np.where(los[rows], np.abs(20*np.log10(dist / chunk["distance"][rows])), 0).max(axis=1, initial=0)
+            accepted &= np.all(los[rows] == los[low], axis=1) & (indexes[rows] == indexes[low]) & (error <= tolerance)
+
+        _fill_rows(chunk, epoch_times, frequency, low[accepted], high[accepted])
+        low, high = (np.concatenate([low[~accepted], first[~accepted], second[~accepted]]),
+                     np.concatenate([first[~accepted], second[~accepted], high[~accepted]]))
+
+    chunk["time"], chunk["longitude"], chunk["latitude"], chunk["altitude"] = epoch_times, longitudes, latitudes, altitudes
+    if stats is not None:
+        stats["adaptive_evaluated"] = stats.get("adaptive_evaluated", 0) + evaluated
+    return chunk
+
+
+def _time_fraction(epoch_times, low, high, rows):
+    """Position in time of the points rows between the points low (0) and high (1)."""
+    span = epoch_times[high] - epoch_times[low]
+    return np.divide(epoch_times[rows] - epoch_times[low], span, out=np.zeros(len(rows)), where=span > 0)
+
+
+def _interpolate_rows(values, epoch_times, low, high, rows):
+    """Linear interpolation in time of values[rows] between values[low] and values[high]."""
+    fraction = _time_fraction(epoch_times, low, high, rows).reshape((-1,) + (1,) * (values.ndim - 1))
+    return values[low] + fraction * (values[high] - values[low])
+
+
+def _fill_rows(chunk, epoch_times, frequency, low, high):
+    """Interpolate the points strictly between low and high, whose relays in sight and closest relay do not change."""
+    lengths = high - low - 1
+    low, high = np.repeat(low, lengths), np.repeat(high, lengths)
+    rows = low + 1 + np.arange(len(low)) - np.repeat(np.cumsum(lengths) - lengths, lengths)
+    if not len(rows):
+        return
+
+    dist = _interpolate_rows(chunk["distance"], epoch_times, low, high, rows)
+    los = chunk["los"][low]
+    losses = np.full(chunk["path_loss"][rows].shape, np.nan)
+    losses[los] = path_loss(frequency, dist[los])
+    indexes = chunk["minimum_index"][low]
+    min_dists = np.where(indexes >= 0, dist[np.arange(len(rows)), indexes], math.inf)
+    chunk["distance"][rows], chunk["los"][rows], chunk["path_loss"][rows] = dist, los, losses
+    chunk["minimum_index"][rows], chunk["minimum_dist"][rows] = indexes, min_dists
+    chunk["minimum_path_loss"][rows] = path_loss(frequency, min_dists)
+
+    if "relays_position" in chunk:
+        positions = chunk["relays_position"]
+        interpolated = _interpolate_rows(positions, epoch_times, low, high, rows)
+        # Interpolate the longitudes across the antimeridian
+        fraction = _time_fraction(epoch_times, low, high, rows)
+        longitude_change = (positions[high, :, 0] - positions[low, :, 0] + 180) % 360 - 180
+        interpolated[..., 0] = (positions[low, :, 0] + fraction[:, np.newaxis] * longitude_change + 180) % 360 - 180
+        positions[rows] = interpolated
+
+
+# Satellites, timescale and cache of a worker process, loaded once by _init_worker
+_worker_satellites = None
+_worker_ts = None
+_worker_cache = None
+
+
+def _init_worker(tles, cache_dir, cache_size):
+    global _worker_satellites, _worker_ts, _worker_cache
+    _worker_satellites = make_relays(tles)
+    _worker_ts = Loader(".").timescale()
+    _worker_cache = ArrayCache(cache_dir, cache_size) if cache_dir is not None else None
+
+
+def _worker_chunk(args, options):
+    """Returns the chunk, and the statistics of its calculation (see merge_stats)."""
+    stats = {}
+    hits, misses = (_worker_cache.hits, _worker_cache.misses) if _worker_cache is not None else (0, 0)
+    chunk = attenuation_chunk(_worker_satellites, _worker_ts, *args, cache=_worker_cache, stats=stats, **options)
+    if _worker_cache is not None:
+        stats["cache_hits"] = _worker_cache.hits - hits
+        stats["cache_misses"] = _worker_cache.misses - misses
+    return chunk, stats
+
+
+def _worker_result(pending, stats):
+    part, future = pending
+    chunk, chunk_stats = future.result()
+    if stats is not None:
+        merge_stats(stats, chunk_stats)
+    return part, chunk
+
+
+def attenuation_chunks(satellites, ts, epoch_times, longitudes, latitudes, altitudes, frequency, write_trajectories, chunk_size,
+                       jobs=1, cache=None, stats=None, ephemeris=None, **options):
+    """Calculate a trajectory chunk by chunk, see attenuation_chunk for the arguments and the options.
+
+    With jobs > 1, the chunks are calculated by as many worker processes, which build their own relays and cache
+    from the TLE of satellites and the directory of cache. At most two chunks per worker are calculated in advance.
+    The ephemeris is only used by a single process.
+
+    Yields:
+        the slice of the points of each chunk and the chunk, in the order of the points
+    """
+    chunks = [slice(start, start+chunk_size) for start in range(0, len(epoch_times), chunk_size)]
+    if jobs > 1:
+        tles = [(name, *element_set.tle) for name, relay in satellites.items() for element_set in relay.history]
+        initargs = (tles, cache.directory, cache.max_size) if cache is not None else (tles, None, 0)
+        pending = collections.deque()
+        with concurrent.futures.ProcessPoolExecutor(max_workers=jobs, initializer=_init_worker, initargs=initargs) as executor:
+            for part in chunks:
+                args = (epoch_times[part], longitudes[part], latitudes[part], altitudes[part], frequency, write_trajectories)
+                pending.append((part, executor.submit(_worker_chunk, args, options)))
+                if len(pending) >= 2*jobs:
+                    yield _worker_result(pending.popleft(), stats)
+            while pending:
+                yield _worker_result(pending.popleft(), stats)
+    else:
+        for part in chunks:
+            yield part, attenuation_chunk(satellites, ts, epoch_times[part], longitudes[part], latitudes[part], altitudes[part],
+                                          frequency, write_trajectories, cache=cache, stats=stats, ephemeris=ephemeris, **options)
+
+
+def merge_stats(total, stats):
+    """Add the statistics of a chunk to total: keys ending with _max and _min keep the extremum, the others are summed."""
+    for key, value in stats.items():
+        if key not in total:
+            total[key] = value
+        elif key.endswith("_max"):
+            total[key] = max(total[key], value)
+        elif key.endswith("_min"):
+            total[key] = min(total[key], value)
+        else:
+            total[key] += value
+
+
+# Memory used to share the relays positions between the trajectories of a batch, in bytes
+EPHEMERIS_MEMORY = 256 * 1024**2
+# Number of chunks of a CSV output that can wait to be written, see utility.CSVWriterThread
+CSV_QUEUED_CHUNKS = 4
+
+
+def point_memory(relays, frequencies, write_trajectories, output_format, compact):
+    """Estimate the memory used for each trajectory point of a chunk, in bytes.
+
+    Returns:
+        the memory used while the chunk is calculated, and the memory used by its results until they are written
+    """
+    value = 4 if compact and output_format == "npy" else 8
+    # Relays positions, pointing vectors and targets (3 floats each), distances, horizon test and path losses
+    calculation = relays * (3*3*8 + 6*8 + 8*frequencies + (2*3*8 if write_trajectories else 0))
+    columns = 2 + frequencies + (3 if write_trajectories else 0)
+    results = relays * (value * (columns - 1) + 1)
+    if output_format == "csv":
+        # The rows have a Python object per cell (about 56 bytes with its list slot), formatted as about 20 characters
+        results += relays * columns * (56 + 20 * (CSV_QUEUED_CHUNKS + 1 if compact else 0))
+    return calculation, results
+
+
+def memory_budget(max_memory, relays, frequencies, write_trajectories, output_format, jobs):
+    """Chunk size and ephemeris memory that keep the process (and its workers) under max_memory bytes.
+
+    The memory already used by the process counts in the budget, and each worker process is assumed to use as much.
+    """
+    used = current_memory() * (jobs + 1 if jobs > 1 else 1)
+    if used >= max_memory:
+        raise RuntimeError("The memory budget ({:.0f} MiB) is below the memory already used ({:.0f} MiB).".format(
+            max_memory / 1024**2, used / 1024**2))
+    available = max_memory - used
+
+    calculation, results = point_memory(relays, frequencies, write_trajectories, output_format, True)
+    # Chunks held at once: computed by every worker, the pending ones (see calculate_trajectory), and the one being written
+    held = 2*jobs + 1 if jobs > 1 else 1
+    ephemeris_memory = available // 4 if jobs == 1 else 0
+    per_point = calculation * jobs + results * held
+    return max(1, int((available - ephemeris_memory) // per_point)), ephemeris_memory
+
+
+def trajectory_files(pattern):
+    """The trajectory files given by the -a option: a file, a directory (all its CSV files) or a glob pattern.
+
+    Returns:
+        the sorted list of files, and whether or not this is a batch of trajectories
+    """
+    if os.path.isdir(pattern):
+        files = sorted(glob.glob(os.path.join(pattern, "*.csv")))
+    elif glob.has_magic(pattern):
+        files = sorted(glob.glob(pattern))
+    else:
+        return [pattern], False
+    if not files:
+        raise RuntimeError("No trajectory file matches \"{}\".".format(pattern))
+    return files, True
 
 
 def trajectory(context):
-    """Calculate the path loss for a given trajectory.
+    """Calculate the path loss for a given trajectory, or for a batch of trajectories.
+
+    For a batch, output_file is a directory where one output per trajectory is written,
+    along with summary.csv which gives the main figures of every trajectory.
+    The relays are propagated once for all the trajectories that overlap in time.
 
     Args (context):
         tle_file: the file containing the TLE of all the satellites, must contains the following columns: tle1, tle2, norad_id.
         trajectory_file: the file containing the trajectory, must contains the following columns: altitude, longitude, latitude, time.
-        frequency: the frequency, in hertz, of the carrier
+            It can also be a directory or a glob pattern, to calculate a batch of trajectories.
+        frequency: the frequency, in hertz, of the carrier, or a list of frequencies which are all written in the same output.
         timestamp: the UTC Epoch timestamp (number of seconds since 01/01/1970).
         output_file: the file where the data are saved.
         confirm: whether or not we have to ask for confirmation.
+        jobs: the number of worker processes the trajectory is split across.
+        chunk_size: the number of trajectory points calculated and written at once.
+        output_format: "csv" for the wide CSV file, "npy" for a directory with one .npy file per quantity.
+        cache_dir: the directory where the relays positions are cached, None to disable the cache.
+        cache_size: the maximum size of the cache, in bytes.
+        interpolation_step: the step, in seconds, of the grid the relays are propagated on before interpolation, None to propagate at every point.
+        max_error: the maximum position error of the interpolation, in meters.
+        propagator: "skyfield" or "sgp4", see actions.propagation.propagate_relays.
+        events: write the table of the visibility events instead of the path loss at every point, see actions.events.
+        event_step: the step, in seconds, of the grid the events are searched on.
+        max_memory: the memory budget in bytes, None to use chunk_size. See memory_budget.
+        adaptive: the path loss tolerance, in dB, of the adaptive mode (see adaptive_chunk), None to calculate every point.
     """
 
     satellites_file    = context.tle_file
@@ -86,84 +519,151 @@ def trajectory(context):
     save_file          = context.output_file
     write_trajectories = context.write_trajectories
     confirm            = context.confirm
+    jobs               = context.jobs
+    chunk_size         = context.chunk_size
+    output_format      = context.output_format
+    cache_dir          = context.cache_dir
+    cache_size         = context.cache_size
+    interpolation      = (context.interpolation_step, context.max_error) if context.interpolation_step is not None else None
+    propagator         = context.propagator
 
     print("Calculating the trajectory")
 
-    # Set up skyfield
-    load = Loader(".")
-    data = load('de421.bsp')
-    ts   = load.timescale()
-    planets = load('de421.bsp')
+    # Set up skyfield, no planetary ephemeris is needed
+    ts = Loader(".").timescale()
 
-    # Load satellites orbits
-    satellites = {}
-    with open(satellites_file, 'r') as csvfile:
-        reader = csv.reader(csvfile, delimiter=',')
+    # Statistics of the calculation (see merge_stats), and time spent in each stage (see utility.timed)
+    stats = {}
 
-        header = next(reader, None)
-        tle1_index, tle2_index, id_index = header_indexes(header, ["tle1", "tle2", "norad_id"])
-        for row in reader:
-            name, L1, L2 = row[id_index], row[tle1_index], row[tle2_index]
-            satellites[name] = EarthSatellite(L1, L2)
+    # Load satellites orbits
+    with timed(stats, "tle_parsing"):
+        satellites = load_satellites(satellites_file)
+    if not satellites:
+        raise RuntimeError("No relay in \"{}\".".format(satellites_file))
+    cache = ArrayCache(cache_dir, cache_size) if cache_dir is not None else None
+
+    files, batch = trajectory_files(trajectory_file)
+    if batch:
+        extension = ".csv" if output_format == "csv" or context.events else ""
+        outputs = [os.path.join(save_file, os.path.splitext(os.path.basename(file))[0] + extension) for file in files]
+    else:
+        outputs = [save_file]
 
     # Check if the output file already exists
-    if confirm and os.path.isfile(save_file):
+    if confirm and os.path.exists(save_file):
         if not confirmation("\"{}\" already exists. Overwrite it ?".format(save_file)):
             raise RuntimeError("Aborting trajectory calculation.")
 
-    # Calculate attenuation at each point of the trajectory
-    data = []  # List of list, [time, dist1, dist2, ..., dist N, minimum dist, minimum name, path_loss]
-
-    with open(trajectory_file, 'r') as csvfile:
-        reader = csv.reader(csvfile, delimiter=',', quotechar='\"')
-        header = next(reader, None)
-        altitude_index, longitude_index, latitude_index, time_index = header_indexes(header, ["altitude", "longitude", "latitude", "time"])
-
-        for row in reader:
-            tofloat = lambda s : float(s.replace(',','.'))
-            try:
-                altitude, longitude, latitude, rela_time = tofloat(row[altitude_index]), tofloat(row[longitude_index]), tofloat(row[latitude_index]), tofloat(row[time_index])
-            except ValueError as e:
-                raise RuntimeError("Ill-formed trajectory file ({}).".format(e))
-            epoch_time = timestamp + rela_time
-            new_time = datetime.datetime.utcfromtimestamp(epoch_time)
-            time = ts.utc(new_time.year, new_time.month, new_time.day, new_time.hour, new_time.minute, new_time.second)
-            pos = Topos(longitude_degrees=longitude, latitude_degrees=latitude, elevation_m=altitude).at(time)
-
-            data.append([epoch_time, longitude, latitude, altitude])
-
-            min_dist = math.inf
-            min_name = "None"
-            dists = []
-            for name, sat in satellites.items():
-                pos_relay = sat.at(time)
-                dist = length_of((pos_relay-pos).distance().m)
-                dists.append(dist)
-                los = line_of_sight(pos, pos_relay)
-                dists.append(path_loss(frequency, dist) if los else "")
-                dists.append(line_of_sight(pos, pos_relay))
-                if los and dist < min_dist:
-                    min_dist = dist
-                    min_name = name
-
-                if write_trajectories:
-                    sub = pos_relay.subpoint()
-                    # dists.extend(list(pos_relay.itrf_xyz().m))
-                    dists.extend([sub.longitude.degrees, sub.latitude.degrees, sub.elevation.m])
-
-            data[-1].append(min_dist)
-            data[-1].append(min_name)
-            data[-1].append(path_loss(frequency, min_dist))
-            data[-1].extend(dists)
-
-    # Save the file
-    with open(save_file, 'w', newline='') as csvfile:
-        spamwriter = csv.writer(csvfile, delimiter=',')
-        sat_headers = []
-        for name in satellites:
-            sat_headers.extend([name + ":dist (m)", name + ":path_loss (dB)", name + ":los"])
-            if write_trajectories:
-                sat_headers.extend([name+":longitude (°)", name+":latitude (°)", name+":altitude (m)"])
-        spamwriter.writerow(["time (s)", "longitude (°)", "latitude (°)", "altitude (m)"] + ["minimum_dist (m)", "minimum_name (norad id)", "path_loss (dB)"] + sat_headers)
-        for line in data:
-            spamwriter.writerow(line)
+    # Read the whole trajectories, so that every relay is propagated once over all the points
+    trajectories = []
+    for file in files:
+        with timed(stats, "trajectory_parsing"):
+            altitudes, longitudes, latitudes, rela_times = read_trajectory(file)
+        if len(rela_times) == 0:
+            raise RuntimeError("The trajectory file \"{}\" does not contain any point.".format(file))
+        trajectories.append((timestamp + rela_times, longitudes, latitudes, altitudes))
+    if batch:
+        os.makedirs(save_file, exist_ok=True)
+        print("{} trajectories".format(len(files)))
+
+    compact = context.max_memory is not None
+    options = {"interpolation": interpolation, "propagator": propagator, "adaptive": context.adaptive, "compact": compact and output_format == "npy"}
+    ephemeris_memory = EPHEMERIS_MEMORY
+    if compact:
+        context.chunk_size, ephemeris_memory = memory_budget(context.max_memory, len(satellites), np.size(frequency), write_trajectories,
+                                                            output_format, jobs)
+        chunk_size = context.chunk_size
+        print("Chunks of {} points, to stay under {:.0f} MiB".format(chunk_size, context.max_memory / 1024**2))
+    ephemeris = None
+    # In adaptive mode, only some points are calculated: propagating the relays at all the times would defeat it
+    if jobs == 1 and not context.events and context.adaptive is None:
+        all_times = np.concatenate([epoch_times for epoch_times, *_ in trajectories])
+        ephemeris = Ephemeris(satellites, ts, all_times, chunk_size, ephemeris_memory, cache, interpolation, propagator, stats)
+
+    # Trajectories are calculated in the order of their start time, so that the positions they share are still in memory
+    summary = [None] * len(files)
+    for i in sorted(range(len(files)), key=lambda i: trajectories[i][0][0]):
+        summary[i] = calculate_trajectory(satellites, ts, *trajectories[i], outputs[i], context, options, stats, ephemeris, cache)
+
+    if batch and not context.events:
+        with open(os.path.join(save_file, "summary.csv"), 'w', newline='') as csvfile:
+            spamwriter = csv.writer(csvfile, delimiter=',')
+            spamwriter.writerow(["trajectory", "output", "points", "start (s)", "end (s)", "in sight (%)",
+                                 "minimum path_loss (dB)", "mean path_loss (dB)", "maximum path_loss (dB)", "handovers"]
+                                + [name + " path_loss" + suffix + " (dB)" for suffix in extra_frequencies(context.frequency) for name in ("minimum", "mean", "maximum")])
+            for file, output, row in zip(files, outputs, summary):
+                spamwriter.writerow([file, output] + row)
+
+    if cache is not None:
+        stats["cache_hits"], stats["cache_misses"] = (stats.get("cache_hits", 0) + cache.hits, stats.get("cache_misses", 0) + cache.misses)
+    points = sum(len(epoch_times) for epoch_times, *_ in trajectories)
+    if context.profiler is not None:
+        context.profiler.add_stats(stats, "trajectory/")
+    if compact:
+        peak = peak_memory() + (jobs * peak_memory(children=True) if jobs > 1 else 0)
+        print("Peak memory: {:.0f} MiB, budget {:.0f} MiB".format(peak / 1024**2, context.max_memory / 1024**2))
+    if context.events:
+        print("Visibility events: {} events, relays propagated at {} times for {} trajectory points".format(
+            stats["events"], stats["evaluations"], points))
+        return
+    if context.adaptive is not None:
+        print("Adaptive stepping: {} of {} points calculated, the others are interpolated".format(stats["adaptive_evaluated"], points))
+    print("Line of sight: {} of {} relay positions pruned by the horizon test".format(
+        stats.get("culled", 0), stats.get("adaptive_evaluated", points) * len(satellites)))
+    if cache is not None:
+        print("Ephemeris cache: {} hits, {} misses".format(stats["cache_hits"], stats["cache_misses"]))
+    if interpolation is not None:
+        print("Relays positions interpolated with a step down to {} s, maximum position error {:.3g} m".format(
+            stats["interpolation_step_min"], stats["interpolation_error_max"]))
+        if stats.get("interpolation_exact_points"):
+            print("    {} relay positions propagated exactly around the changes of TLE".format(stats["interpolation_exact_points"]))
+
+
+def calculate_trajectory(satellites, ts, epoch_times, longitudes, latitudes, altitudes, save_file, context, options, stats, ephemeris=None, cache=None):
+    """Calculate one trajectory and write it to save_file.
+
+    Returns:
+        None for the events table, otherwise the summary of the trajectory: [points, start, end, percentage of points with a relay in sight,
+        minimum, mean and maximum path loss to the closest relay in sight, number of changes of the closest relay,
+        minimum, mean and maximum path loss at the other frequencies]
+    """
+    frequency          = context.frequency
+    write_trajectories = context.write_trajectories
+    jobs               = context.jobs
+    chunk_size         = context.chunk_size
+
+    if context.events:
+        # Imported here because actions.events builds on this module
+        from .events import VisibilityState, visibility_events, write_events
+        state = VisibilityState(satellites, ts, epoch_times, longitudes, latitudes, altitudes, options["propagator"])
+        with timed(stats, "events", len(epoch_times)):
+            events = visibility_events(state, context.event_step, block_size=chunk_size, cache=cache)
+        with timed(stats, "output"):
+            write_events(save_file, state, events, list(satellites), frequency)
+        merge_stats(stats, {"events": len(events), "evaluations": state.evaluations})
+        return None
+
+    # Calculate the trajectory chunk by chunk, each chunk is written while the next one is calculated,
+    # so only a few chunks are in memory at the same time
+    minimum_indexes = np.empty(len(epoch_times), dtype=int)
+    minimum_path_loss = np.empty((len(epoch_times),) + np.shape(frequency))
+
+    def write(writer, part, chunk):
+        with timed(stats, "output", len(chunk["time"])):
+            writer.write(chunk)
+        minimum_indexes[part] = chunk["minimum_index"]
+        minimum_path_loss[part] = chunk["minimum_path_loss"]
+
+    with open_output(context.output_format, save_file, list(satellites), len(epoch_times), frequency, write_trajectories,
+                     context.max_memory is not None) as writer:
+        for part, chunk in attenuation_chunks(satellites, ts, epoch_times, longitudes, latitudes, altitudes, frequency, write_trajectories,
+                                              chunk_size, jobs, cache, stats, ephemeris, **options):
+            write(writer, part, chunk)
+
+    in_sight = minimum_indexes >= 0
+    visible_path_loss = minimum_path_loss[in_sight].reshape(-1, minimum_path_loss[0].size)
+    handovers = np.count_nonzero(np.diff(minimum_indexes[in_sight])) if np.any(in_sight) else 0
+    path_loss_range = []
+    for column in visible_path_loss.T:
+        path_loss_range.extend([column.min(), column.mean(), column.max()] if len(column) else ["", "", ""])
+    return [len(epoch_times), epoch_times[0], epoch_times[-1], 100 * np.count_nonzero(in_sight) / len(epoch_times)] + path_loss_range[:3] + [handovers] + path_loss_range[3:]
@@ -13,6 +13,15 @@ class Context:
         # Files
         self.id_file = None
         self.download_file = ".tle_sat"
+        self.tle_url = "https://www.n2yo.com/satellite/?s={}"
+        self.tle_source = None
+        self.download_concurrency = 8
+        self.download_rate = 10.0
+        self.download_timeout = 30.0
+        self.download_retries = 3
+        self.tle_store = ".tle_store.csv"
+        self.tle_max_age = 3 * 86400
+        self.tle_history = 30 * 86400
         self.tle_file = ".tle_sat"
         self.output_file = "output.csv"
         self.trajectory_file = None
@@ -22,6 +31,42 @@ class Context:
         self.write_trajectories = False
         self.time = time.time()
         self.frequency = 1616e6
+        self.jobs = 1
+        self.chunk_size = 1000
+        self.output_format = "csv"
+        self.cache_dir = None
+        self.cache_size = 1024**3
+        self.interpolation_step = None
+        self.max_error = 1.0
+        self.propagator = "skyfield"
+        self.events = False
+        self.event_step = 10.0
+        self.adaptive = None
+        self.max_memory = None
+        self.profiler = None
+        self.profile_file = None
+        self.cprofile_file = None
+        self.serve_address = None
+
+
+def get_frequencies(string, opt):
+    """Parse a frequency, a comma separated list of frequencies or a START:STOP:STEP range (STOP included).
+    Returns the frequency, or the list of frequencies if there are several, and whether or not the argument is valid."""
+    try:
+        if ":" in string:
+            start, stop, step = (float(s) for s in string.split(":"))
+            if step <= 0 or stop < start:
+                raise ValueError
+            frequencies = [start + i*step for i in range(int((stop - start) / step * (1 + 1e-12)) + 1)]
+        else:
+            frequencies = [float(s) for s in string.split(",")]
+    except ValueError:
+        print("{} argument must be a real number, a comma separated list or a START:STOP:STEP range.".format(opt))
+        return 0, False
+    if any(f <= 0 for f in frequencies):
+        print("{} argument must be positive.".format(opt))
+        return 0, False
+    return (frequencies[0] if len(frequencies) == 1 else frequencies), True
 
 
 def get_time(string, opt):
@@ -55,7 +100,32 @@ def main(argv):
             "frequency=",
             "help",
             "trajectory=",
-            "view="
+            "view=",
+            "jobs=",
+            "chunk-size=",
+            "format=",
+            "cache=",
+            "cache-size=",
+            "interpolate=",
+            "max-error=",
+            "propagator=",
+            "events",
+            "event-step=",
+            "adaptive=",
+            "profile",
+            "profile-json=",
+            "cprofile=",
+            "max-memory=",
+            "serve=",
+            "tle-url=",
+            "tle-source=",
+            "download-concurrency=",
+            "download-rate=",
+            "download-timeout=",
+            "download-retries=",
+            "tle-store=",
+            "tle-max-age=",
+            "tle-history="
         ])
 
     except getopt.GetoptError as E:
@@ -74,9 +144,69 @@ def main(argv):
 
     for opt, arg in opts:
         if opt in ("-d", "--download"):
-            acts.append(actions.Action("Download TLE coordinates", 0, actions.downloadTLE))
+            acts.append(actions.Action("Download TLE coordinates", 0, "actions.downloadTLE.downloadTLE"))
             context.id_file = arg
 
+        elif opt == "--tle-url":
+            if "{}" not in arg:
+                print("{} argument must contain \"{{}}\", replaced by the norad id.".format(opt))
+                sys.exit(1)
+            context.tle_url = arg
+
+        elif opt in ("--download-concurrency", "--download-retries"):
+            try:
+                value = int(arg)
+            except ValueError:
+                print("{} argument must be an integer.".format(opt))
+                sys.exit(1)
+            if value < (1 if opt == "--download-concurrency" else 0):
+                print("{} argument is too small.".format(opt))
+                sys.exit(1)
+            if opt == "--download-concurrency":
+                context.download_concurrency = value
+            else:
+                context.download_retries = value
+
+        elif opt in ("--download-rate", "--download-timeout"):
+            try:
+                value = float(arg)
+            except ValueError:
+                print("{} argument must be a real number.".format(opt))
+                sys.exit(1)
+            if value < 0 or value == 0 and opt == "--download-timeout":
+                print("{} argument must be positive.".format(opt))
+                sys.exit(1)
+            if opt == "--download-rate":
+                context.download_rate = value or None
+            else:
+                context.download_timeout = value
+
+        elif opt == "--tle-source":
+            context.tle_source = arg
+
+        elif opt == "--tle-store":
+            context.tle_store = arg
+
+        elif opt == "--tle-max-age":
+            try:
+                context.tle_max_age = float(arg) * 86400
+            except ValueError:
+                print("{} argument must be a real number.".format(opt))
+                sys.exit(1)
+            if context.tle_max_age < 0:
+                print("{} argument must be positive.".format(opt))
+                sys.exit(1)
+
+        elif opt == "--tle-history":
+            try:
+                context.tle_history = float(arg) * 86400
+            except ValueError:
+                print("{} argument must be a real number.".format(opt))
+                sys.exit(1)
+            if context.tle_history < 0:
+                print("{} argument must be positive.".format(opt))
+                sys.exit(1)
+
         elif opt in ("-i", "--tle"):
             context.tle_file = arg
 
@@ -95,27 +225,137 @@ def main(argv):
             context.write_trajectories = True
 
         elif opt in ("-f", "--frequency"):
+            context.frequency, ok = get_frequencies(arg, opt)
+            if not ok:
+                sys.exit(1)
+            if isinstance(context.frequency, list):
+                print("Frequencies set to {} MHz".format(", ".join("{:g}".format(f/1e6) for f in context.frequency)))
+            else:
+                print(f"Frequency set to {context.frequency/1e6} MHz")
+
+        elif opt == "--jobs":
+            try:
+                context.jobs = int(arg)
+            except ValueError:
+                print("{} argument must be an integer.".format(opt))
+                sys.exit(1)
+            if context.jobs < 1:
+                print("{} argument must be at least 1.".format(opt))
+                sys.exit(1)
+
+        elif opt == "--chunk-size":
+            try:
+                context.chunk_size = int(arg)
+            except ValueError:
+                print("{} argument must be an integer.".format(opt))
+                sys.exit(1)
+            if context.chunk_size < 1:
+                print("{} argument must be at least 1.".format(opt))
+                sys.exit(1)
+
+        elif opt == "--format":
+            if arg not in actions.OUTPUT_FORMATS:
+                print("{} argument must be one of: {}.".format(opt, ", ".join(actions.OUTPUT_FORMATS)))
+                sys.exit(1)
+            context.output_format = arg
+
+        elif opt == "--cache":
+            context.cache_dir = arg
+
+        elif opt == "--cache-size":
             try:
-                context.frequency = float(arg)
+                context.cache_size = float(arg) * 1024**2
             except ValueError:
                 print("{} argument must be a real number.".format(opt))
                 sys.exit(1)
-            print(f"Frequency set to {context.frequency/1e6} MHz")
+
+        elif opt == "--interpolate":
+            try:
+                context.interpolation_step = int(arg)
+            except ValueError:
+                print("{} argument must be an integer.".format(opt))
+                sys.exit(1)
+            if context.interpolation_step < 2:
+                print("{} argument must be at least 2 seconds.".format(opt))
+                sys.exit(1)
+
+        elif opt == "--max-error":
+            try:
+                context.max_error = float(arg)
+            except ValueError:
+                print("{} argument must be a real number.".format(opt))
+                sys.exit(1)
+
+        elif opt == "--propagator":
+            if arg not in actions.PROPAGATORS:
+                print("{} argument must be one of: {}.".format(opt, ", ".join(actions.PROPAGATORS)))
+                sys.exit(1)
+            context.propagator = arg
+
+        elif opt == "--events":
+            context.events = True
+
+        elif opt == "--event-step":
+            try:
+                context.event_step = float(arg)
+            except ValueError:
+                print("{} argument must be a real number.".format(opt))
+                sys.exit(1)
+            if context.event_step <= 0:
+                print("{} argument must be positive.".format(opt))
+                sys.exit(1)
+
+        elif opt == "--adaptive":
+            try:
+                context.adaptive = float(arg)
+            except ValueError:
+                print("{} argument must be a real number.".format(opt))
+                sys.exit(1)
+            if context.adaptive <= 0:
+                print("{} argument must be positive.".format(opt))
+                sys.exit(1)
+
+        elif opt == "--max-memory":
+            try:
+                context.max_memory = float(arg) * 1024**2
+            except ValueError:
+                print("{} argument must be a real number.".format(opt))
+                sys.exit(1)
+            if context.max_memory <= 0:
+                print("{} argument must be positive.".format(opt))
+                sys.exit(1)
+
+        elif opt in ("--profile", "--profile-json", "--cprofile"):
+            # Imported here, it is not needed without profiling
+            from utility import Profiler
+            context.profiler = context.profiler or Profiler()
+            if opt == "--profile-json":
+                context.profile_file = arg
+            elif opt == "--cprofile":
+                context.cprofile_file = arg
 
         elif opt in ("-h", "--help"):
             usage()
             sys.exit(0)
 
         elif opt in ("-a", "--trajectory"):
-            acts.append(actions.Action("Calculate the trajectory", 10, actions.trajectory))
+            acts.append(actions.Action("Calculate the trajectory", 10, "actions.trajectory.trajectory"))
             context.trajectory_file = arg
 
+        elif opt == "--serve":
+            acts.append(actions.Action("Serve attenuation queries", 20, "actions.server.serve"))
+            context.serve_address = arg
+
         elif opt in ("--view"):
-            acts.append(actions.Action("3D visualization of previous results.", 15, actions.view3D))
+            acts.append(actions.Action("3D visualization of previous results.", 15, "actions.opengl.view3D"))
             context.visualization_file = arg
 
     # Sort actions according to their priority
     acts.sort(key=lambda a: a.priority)
+    if context.cprofile_file is not None:
+        import cProfile
+        profile = cProfile.Profile()
+        profile.enable()
     for action in acts:
         try:
             action.run(context)
@@ -123,6 +363,17 @@ def main(argv):
             print("Error: {}".format(E))
             sys.exit(1)
 
+    if context.cprofile_file is not None:
+        profile.disable()
+        profile.dump_stats(context.cprofile_file)
+        print("cProfile statistics written to {}".format(context.cprofile_file))
+    if context.profiler is not None:
+        print("Profile:")
+        print(context.profiler.report())
+        if context.profile_file is not None:
+            context.profiler.save(context.profile_file)
+            print("Profile written to {}".format(context.profile_file))
+
 
 def usage():
     ctx = Context()
@@ -137,9 +388,61 @@ OPTIONS:
     -d, --download <CSV FILE>:
         Download the TLE coordinates of the satellites listed in the CSV file. A header with the column "norad_id" must be present.
         Write the result in the file {ctx.download_file}.
+        The pages are downloaded concurrently over keep-alive connections. The requests failing with a network error, a timeout
+        or a server error are retried with an exponential backoff, the satellites still failing are listed at the end.
+        The pages are only parsed up to the TLE; the rest of each page is still received, and dropped, so that the
+        connection can be reused for the next satellite.
+        The TLE are kept in the store (--tle-store): only the satellites missing from the store, or whose TLE is older than
+        --tle-max-age, are downloaded. The numbers of TLE up to date, refreshed, added and failed are printed.
+        The store keeps the TLE of the epochs fetched over the last --tle-history days, and they are all written: a
+        satellite has one row per epoch, so that past trajectories are calculated with the TLE of their time (see -i).
+
+    --tle-source <FILE OR URL>:
+        Take the TLE from a multi-object element set file or URL, in the 2-line or 3-line format (like the catalogues
+        of CelesTrak or Space-Track), instead of downloading one page per satellite from --tle-url. The catalogue is
+        filtered by the norad ids of the -d file, it can hold tens of thousands of satellites.
+        By default the TLE are downloaded from --tle-url.
+
+    --tle-store <FILE>:
+        File where the downloaded TLE are kept between runs, with their epoch and the time they have been fetched at.
+        A TLE of a new epoch is added to the ones of the satellite, the older ones are kept for --tle-history days.
+        Default is {ctx.tle_store}.
+
+    --tle-max-age <DAYS>:
+        Download again the TLE whose epoch is older than DAYS days, 0 downloads all of them again. A TLE fetched less than
+        6 hours ago is not downloaded again, the tracking website would give the same one.
+        Default is {ctx.tle_max_age/86400:g} days.
+
+    --tle-history <DAYS>:
+        Keep in the store, and write with -d, the TLE whose epoch is at most DAYS days older than the latest TLE of the
+        satellite. Every satellite then has about one row per download of the period. 0 keeps only the latest TLE.
+        Default is {ctx.tle_history/86400:g} days.
+
+    --tle-url <URL>:
+        URL of the page giving the TLE of a satellite, "{{}}" is replaced by its norad id.
+        Default is {ctx.tle_url}.
+
+    --download-concurrency <N>:
+        Maximum number of requests in progress at the same time during the download.
+        Default is {ctx.download_concurrency}.
+
+    --download-rate <RATE>:
+        Maximum number of requests started per second during the download, 0 for no limit.
+        Default is {ctx.download_rate}.
+
+    --download-timeout <SECONDS>:
+        Time allowed to each request of the download.
+        Default is {ctx.download_timeout} s.
+
+    --download-retries <N>:
+        Number of times a failed request of the download is retried.
+        Default is {ctx.download_retries}.
 
     -i, --tle <CSV FILE>:
         Use the satellites mentionned in the file. The file must contains a header with the columns "norad_id", "tle1" and "tle2".
+        A satellite can have several rows, with TLE of different epochs: each time of the trajectory is then calculated with
+        the TLE of the closest epoch, which keeps long trajectories and past events accurate. With --interpolate, the positions
+        whose interpolation would mix the TLE of two epochs are propagated exactly instead.
         By default the file {ctx.tle_file} is used.
 
     --noconfirm:
@@ -159,9 +462,85 @@ OPTIONS:
         By default the current time (e.g. {ctx.time}) is used.
 
     -f, --frequency <FREQUENCY>:
-        Set the frequency used to calculate path loss, in MHz.
+        Set the frequency used to calculate path loss, in Hz.
+        Several frequencies can be given as a comma separated list (1616e6,2200e6,8400e6) or as a START:STOP:STEP range
+        (2000e6:2400e6:100e6, STOP included). The relays are propagated once and the path loss at every frequency is
+        computed from the same distances: the output gets extra path loss columns for the frequencies after the first one.
         Default is {ctx.frequency/1e6} MHz.
 
+    --jobs <N>:
+        Split the trajectory calculation across N processes. The output is the same as with a single process.
+        Default is {ctx.jobs}.
+
+    --chunk-size <N>:
+        Number of trajectory points calculated at once. Results are written to the output file chunk by chunk
+        while the next chunk is calculated, so the memory used does not depend on the trajectory length.
+        Default is {ctx.chunk_size}.
+
+    --format <FORMAT>:
+        Format of the output, "csv" for a CSV file with one row per point, or "npy" for a directory (named after
+        the output file name) holding one .npy file per quantity and a header.json with the names of the relays.
+        The "npy" output is much smaller and faster to write, and --view opens it without parsing it.
+        Default is {ctx.output_format}.
+
+    --cache <DIRECTORY>:
+        Store the propagated positions of the relays in this directory, and reuse them in the next runs
+        when the TLE and the times of the trajectory are the same. The number of cache hits and misses is printed.
+        By default there is no cache.
+
+    --cache-size <SIZE>:
+        Maximum size of the cache, in MiB. The least recently used positions are removed first.
+        Default is {ctx.cache_size/1024**2:.0f} MiB.
+
+    --interpolate <STEP>:
+        Propagate the relays every STEP seconds only (30 to 60 s is a good choice for low orbits), and interpolate
+        their positions at the times of the trajectory. The interpolation is checked against exact positions and
+        the step is reduced until the error is below --max-error. The error achieved is printed.
+        By default the relays are propagated at every point of the trajectory.
+
+    --max-error <DISTANCE>:
+        Maximum position error of the interpolation, in meters.
+        Default is {ctx.max_error} m.
+
+    --propagator <PROPAGATOR>:
+        "skyfield" propagates the relays one by one with skyfield, "sgp4" propagates all of them at once with the
+        array interface of the sgp4 library, which is much faster for large constellations. Both give the same results.
+        Default is {ctx.propagator}.
+
+    --events:
+        Instead of the path loss at every point, write a table of the visibility events: the times at which each relay
+        rises above or sets below the horizon of the target, and the handovers between the closest relays in sight,
+        with the distance and path loss at that time. The events are searched on a grid of --event-step seconds and
+        refined to the millisecond, which is much faster than calculating every point of the trajectory.
+        The output is always a CSV file, the options --format, --jobs and --write-trajectories are ignored.
+
+    --event-step <STEP>:
+        Step of the grid the events are searched on, in seconds. Relays in sight for less than STEP seconds may be missed.
+        Default is {ctx.event_step} s.
+
+    --adaptive <TOLERANCE>:
+        Calculate only some points of the trajectory and interpolate the others. One point every 32 is calculated first,
+        then more points are calculated around the changes of relays in sight and of closest relay, and wherever the
+        interpolated path loss is more than TOLERANCE dB away from the calculated one. The number of points actually
+        calculated is printed. By default every point is calculated.
+
+    --max-memory <SIZE>:
+        Keep the memory used by the trajectory calculation under SIZE MiB, worker processes included: the number of
+        points calculated at once (--chunk-size) is chosen from the number of relays and the options. The CSV rows are
+        formatted before waiting to be written, and the "npy" output stores distances, path losses and relay positions
+        as float32. The peak memory actually used is printed. By default there is no limit.
+
+    --profile:
+        Print, at the end of the run, the wall time, number of calls and points per second of every action and of
+        every stage of the trajectory calculation and of the download. With --jobs, the times of the stages calculated
+        by the worker processes are summed over the processes.
+
+    --profile-json <FILE>:
+        Same as --profile, and also write the report in a JSON file.
+
+    --cprofile <FILE>:
+        Same as --profile, and also run the actions under cProfile and write its statistics in FILE
+        (for pstats or snakeviz). Only the main process is profiled.
 
     -h, --help:
         Show this help.
@@ -170,9 +549,26 @@ MODES:
     -a, --trajectory <TRAJECTORY FILE>:
         Calculate the attenuation of the signal in function of time, given a particular trajectory.
         The trajectory file must be in CSV format, with a header containing the following columns : altitude, longitude, latitude and time.
+        A directory (all its CSV files) or a quoted glob pattern calculates a batch of trajectories: the output file is then a directory
+        with one output per trajectory, named after the trajectory file, and summary.csv which gives the main figures of every trajectory.
+        The relays are propagated only once for the times the trajectories have in common.
 
     -v, --view <TRAJECTORY FILE>:
-        Three-dimensional visualization of the given file. Note: the file must have been generated with option --write-trajectories.
+        Three-dimensional visualization of the given file (or "npy" directory). Note: the file must have been generated with option --write-trajectories.
+
+    --serve <ADDRESS>:
+        Load the relays once and answer attenuation queries over HTTP until interrupted, instead of starting the program for
+        every query. <ADDRESS> is HOST:PORT, or the path of a Unix socket (containing a "/" or ending with .sock).
+        The positions of the relays at the recently queried times are kept in memory and shared by the queries
+        (--cache is not used).
+        --propagator sgp4 gives the lowest latency. The server answers:
+            GET /relays: the names of the relays.
+            POST /attenuation: a JSON object {{"time": T, "longitude": LON, "latitude": LAT, "altitude": ALT}} for a single
+                point, or with lists of values for a batch of points. "frequency" and "write_trajectories" are optional.
+            POST /trajectory?time=<TIME>: a trajectory file as the body, its times are relative to <TIME>.
+                The parameters frequency, write_trajectories=1 and format=csv are optional.
+        The answer is a JSON object with the distance, path loss and line of sight to every relay, and the closest relay
+        in sight at every point, or the CSV output with format=csv.
 
 EXAMPLES:
     python ./attenuationCalc.py -d ./iridium_id.csv -o output_test.csv --write-trajectories -a ./serenade_ecc_0.csv --noconfirm
@@ -187,6 +583,13 @@ EXAMPLES:
         Here we take advantage of the default filename for the output file ("output.csv") and we don't download the TLE data because we assume they are
         already been downloaded.
 
+    python ./attenuationCalc.py -a "./trajectories/*.csv" -o ./results --noconfirm
+        Calculate the path loss for every trajectory in the trajectories directory, the results are written in the results directory.
+
+    python ./attenuationCalc.py --serve localhost:8080 --propagator sgp4
+        Answer the attenuation queries on port 8080, for example:
+        curl -d '{{"time": 1729080000, "longitude": 2.35, "latitude": 48.85, "altitude": 35}}' http://localhost:8080/attenuation
+
 """
     print(helpMessage[1:-2])
 
@@ -0,0 +1,217 @@
+"""Throughput of each stage of the attenuation pipeline, on synthetic constellations and trajectories.
+
+Everything is generated locally, nothing is downloaded. For every scenario (number of satellites x number of points),
+the stages of actions.trajectory are timed separately, chunk by chunk like trajectory() does. The chunks are calculated
+by attenuation_chunk itself, and its stages are the ones it records with utility.timed:
+    tle_parsing         load_satellites on a generated TLE file
+    trajectory_parsing  read_trajectory on a generated trajectory file
+    target_position     ITRF positions of the points of the trajectory
+    propagation         propagate_relays
+    line_of_sight       attenuation(): distances, horizon test, exact line of sight test and path loss
+    path_loss           path loss of the relays in sight, part of line_of_sight (not added to the total)
+    subpoints           geographic_positions of the relays (written with --write-trajectories)
+    csv_writing         conversion of the chunks to CSV rows and writing them
+    view_loading        opengl.load_from_file on the CSV output, only for the smallest outputs (see --max-view-pairs)
+
+The results are written as JSON, and can be compared with the results of another commit with --compare.
+The default scenarios take tens of minutes, mostly writing CSV. For a quick check: --satellites 66,1000 --points 1000,10000
+
+Usage:
+    python benchmarks/pipeline.py [OPTIONS]
+
+Options:
+    --satellites N,N,...   constellation sizes (default 66,1000,10000)
+    --points N,N,...       trajectory lengths (default 1000,10000,100000,1000000)
+    --max-pairs N          skip the scenarios with more satellites x points than N (default 1e8)
+    --max-view-pairs N     only time view_loading up to N satellites x points (default 2e6)
+    --propagator NAME      "skyfield" or "sgp4" (default skyfield)
+    --chunk-size N         number of points per chunk (default 1000)
+    --output FILE          where the JSON results are written (default benchmarks/results-<commit>.json, ignored by git)
+    --compare FILE         print the ratio of every stage to the results in FILE
+"""
+import getopt
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+import csv
+
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from actions.propagation import load_satellites  # noqa: E402
+from actions.trajectory import read_trajectory, attenuation_chunk  # noqa: E402
+from actions.output import csv_header, chunk_rows  # noqa: E402
+from actions.catalogue import tle_checksum  # noqa: E402
+
+# Start of the synthetic trajectories, close to the epoch of the synthetic TLE
+TIMESTAMP = 1729080000.0
+FREQUENCY = 1616e6
+STAGES = ["tle_parsing", "trajectory_parsing", "target_position", "propagation", "line_of_sight", "path_loss", "subpoints", "csv_writing",
+          "view_loading"]
+# Stages timed within another one, not added to the total
+NESTED_STAGES = ["path_loss"]
+
+
+def write_constellation(file, count, planes=6):
+    """Write a TLE file of count satellites in polar orbits at 780 km, evenly spread over the given number of planes."""
+    per_plane = (count + planes - 1) // planes
+    with open(file, 'w', newline='') as csvfile:
+        spamwriter = csv.writer(csvfile, delimiter=',')
+        spamwriter.writerow(["number", "norad_id", "tle1", "tle2"])
+        for i in range(count):
+            plane, rank = divmod(i, per_plane)
+            norad_id = 10000 + i
+            line1 = "1 {:05d}U 17003A   24290.50000000  .00000100  00000-0  30000-4 0  999".format(norad_id)
+            line2 = "2 {:05d}  86.4000 {:8.4f} 0002000  90.0000 {:8.4f} 14.3421600010000".format(
+                norad_id, plane * 180.0 / planes, (rank * 360.0 / per_plane + plane * 16.0) % 360)
+            spamwriter.writerow([i, norad_id, line1 + str(tle_checksum(line1)), line2 + str(tle_checksum(line2))])
+
+
+def write_trajectory(file, points):
+    """Write a trajectory file of points one second apart, in the format of the trajectory files of the repository:
+    a reentry from 120 km, with decimal commas."""
+    times = np.arange(1, points + 1)
+    altitudes = np.maximum(120000 - 0.12 * times, 0).astype(int)
+    latitudes = 40 * np.sin(times / 3000)
+    longitudes = (119 + 0.068 * times + 180) % 360 - 180
+    with open(file, 'w', newline='') as f:
+        f.write("time,altitude,latitude,longitude,Vitesse\n")
+        for t, altitude, latitude, longitude in zip(times.tolist(), altitudes.tolist(), latitudes.tolist(), longitudes.tolist()):
+            f.write('{},{},"{}","{}",7844\n'.format(t, altitude, "{:.3f}".format(latitude).replace(".", ","), "{:.3f}".format(longitude).replace(".", ",")))
+
+
+def run_scenario(directory, satellites_count, points, propagator, chunk_size, max_view_pairs):
+    """Time every stage of the pipeline for one scenario. Returns a dict of stage -> seconds (None when skipped)."""
+    from skyfield.api import Loader
+
+    tle_file = os.path.join(directory, "tle.csv")
+    trajectory_file = os.path.join(directory, "trajectory.csv")
+    output_file = os.path.join(directory, "output.csv")
+    write_constellation(tle_file, satellites_count)
+    write_trajectory(trajectory_file, points)
+    ts = Loader(directory).timescale()
+    timings = dict.fromkeys(STAGES, 0.0)
+
+    start = time.perf_counter()
+    satellites = load_satellites(tle_file)
+    timings["tle_parsing"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    altitudes, longitudes, latitudes, rela_times = read_trajectory(trajectory_file)
+    timings["trajectory_parsing"] = time.perf_counter() - start
+    epoch_times = TIMESTAMP + rela_times
+
+    names = list(satellites)
+    stats = {}
+    with open(output_file, 'w', newline='') as csvfile:
+        spamwriter = csv.writer(csvfile, delimiter=',')
+        spamwriter.writerow(csv_header(names, True))
+        for first in range(0, points, chunk_size):
+            part = slice(first, first + chunk_size)
+            chunk = attenuation_chunk(satellites, ts, epoch_times[part], longitudes[part], latitudes[part], altitudes[part], FREQUENCY,
+                                      True, propagator=propagator, stats=stats)
+            start = time.perf_counter()
+            spamwriter.writerows(chunk_rows(chunk, names, True))
+            timings["csv_writing"] += time.perf_counter() - start
+    for stage in ("target_position", "propagation", "line_of_sight", "path_loss", "subpoints"):
+        timings[stage] = stats.get("profile:{}:seconds".format(stage), 0.0)
+
+    timings["view_loading"] = None
+    if satellites_count * points <= max_view_pairs:
+        try:
+            from opengl.Satellite import load_from_file
+        except ImportError as E:
+            print("    view_loading skipped, the viewer can not be imported: {}".format(E))
+        else:
+            start = time.perf_counter()
+            load_from_file(output_file)
+            timings["view_loading"] = time.perf_counter() - start
+    return timings
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def compare(results, reference_file):
+    """Print the ratio of the time of every stage to the one of the reference results (> 1 is slower)."""
+    with open(reference_file, 'r') as f:
+        reference = json.load(f)
+    scenarios = {(r["satellites"], r["points"]): r["stages"] for r in reference["results"]}
+    print("Compared to {} ({}):".format(reference_file, reference.get("commit")))
+    for result in results["results"]:
+        old = scenarios.get((result["satellites"], result["points"]))
+        if old is None:
+            continue
+        ratios = ["{} x{:.2f}".format(stage, seconds / old[stage]) for stage, seconds in result["stages"].items()
+                  if seconds is not None and old.get(stage)]
+        print("    {} satellites, {} points: {}".format(result["satellites"], result["points"], ", ".join(ratios)))
+
+
+def main(argv):
+    try:
+        opts, args = getopt.getopt(argv, "", ["satellites=", "points=", "max-pairs=", "max-view-pairs=", "propagator=",
+                                              "chunk-size=", "output=", "compare="])
+    except getopt.GetoptError as E:
+        print(E)
+        print(__doc__)
+        sys.exit(2)
+
+    satellites, points = [66, 1000, 10000], [1000, 10000, 100000, 1000000]
+    max_pairs, max_view_pairs, propagator, chunk_size = 1e8, 2e6, "skyfield", 1000
+    commit = git_commit()
+    output, reference = os.path.join(ROOT, "benchmarks", "results-{}.json".format(commit)), None
+    for opt, arg in opts:
+        if opt == "--satellites":
+            satellites = [int(n) for n in arg.split(",")]
+        elif opt == "--points":
+            points = [int(n) for n in arg.split(",")]
+        elif opt == "--max-pairs":
+            max_pairs = float(arg)
+        elif opt == "--max-view-pairs":
+            max_view_pairs = float(arg)
+        elif opt == "--propagator":
+            propagator = arg
+        elif opt == "--chunk-size":
+            chunk_size = int(arg)
+        elif opt == "--output":
+            output = arg
+        elif opt == "--compare":
+            reference = arg
+
+    results = {"commit": commit, "date": time.strftime("%Y-%m-%dT%H:%M:%S"), "python": platform.python_version(),
+               "numpy": np.__version__, "platform": platform.platform(), "propagator": propagator, "chunk_size": chunk_size, "results": []}
+    for satellites_count in satellites:
+        for points_count in points:
+            if satellites_count * points_count > max_pairs:
+                print("{} satellites, {} points: skipped (more than {:g} pairs)".format(satellites_count, points_count, max_pairs))
+                continue
+            with tempfile.TemporaryDirectory() as directory:
+                stages = run_scenario(directory, satellites_count, points_count, propagator, chunk_size, max_view_pairs)
+            # The viewer is not part of a trajectory calculation
+            total = sum(seconds for stage, seconds in stages.items() if stage != "view_loading" and stage not in NESTED_STAGES)
+            print("{} satellites, {} points: {:.2f} s, {:.0f} points/s".format(satellites_count, points_count, total, points_count / total))
+            for stage, seconds in stages.items():
+                if seconds is not None:
+                    print("    {:<20} {:9.3f} s".format(stage, seconds))
+            results["results"].append({"satellites": satellites_count, "points": points_count, "stages": stages,
+                                       "total": total, "points_per_second": points_count / total})
+
+    with open(output, 'w') as f:
+        json.dump(results, f, indent=2)
+    print("Results written to {}".format(output))
+    if reference is not None:
+        compare(results, reference)
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,44 @@
+"""Startup time of attenuationCalc for each mode.
+
+Each mode is measured in fresh interpreters: the time to start Python, import attenuationCalc and import the
+modules the mode needs, which is what a run pays before doing any work.
+
+Usage:
+    python benchmarks/startup.py [REPEAT]
+"""
+import subprocess
+import statistics
+import sys
+import time
+import os
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+MODES = {
+    "--help": "import attenuationCalc",
+    "-d, --download": "import attenuationCalc, actions.downloadTLE",
+    "-a, --trajectory": "import attenuationCalc, actions.trajectory",
+    "--view": "import attenuationCalc, actions.opengl",
+}
+
+
+def measure(code, repeat):
+    durations = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        subprocess.run([sys.executable, "-c", code], cwd=ROOT, check=True)
+        durations.append(time.perf_counter() - start)
+    return statistics.median(durations)
+
+
+def main(argv):
+    repeat = int(argv[0]) if argv else 5
+    baseline = measure("pass", repeat)
+    print("Interpreter alone: {:.0f} ms".format(baseline*1000))
+    for mode, code in MODES.items():
+        duration = measure(code, repeat)
+        print("{:<20} {:6.0f} ms ({:+.0f} ms of imports)".format(mode, duration*1000, (duration-baseline)*1000))
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,168 @@
+"""Extraction of the TLE from a page of the tracking website: BeautifulSoup against actions.downloadTLE.TLEPageParser.
+
+The page is synthetic, shaped like the satellite pages of n2yo.com: a long head of scripts and styles, the TLE block
+in the middle of the body, then tables and scripts. The BeautifulSoup parser builds the tree of the whole page, as the
+download did before; TLEPageParser is fed the page by pieces, as they are received, and stops parsing after the TLE.
+
+Parsing: the time per page and the peak memory allocated while parsing (tracemalloc), on the page in memory.
+Fetch: the time per page of utility.fetch_all downloading the page from a local HTTP server, with TLEPageParser or with
+BeautifulSoup on the whole body. After the TLE, fetch_all reads the rest of the body without keeping it, to reuse the
+connection; "TLEPageParser, closing" abandons the rest of the body by closing the connection instead, the number of
+connections opened shows what it costs (a TCP and TLS handshake each with the real website).
+
+Usage:
+    python benchmarks/tle_page.py [OPTIONS]
+
+Options:
+    --size KB          size of the page (default 80)
+    --piece KB         size of the pieces given to TLEPageParser (default 16, a few network reads)
+    --repeat N         number of pages parsed and fetched (default 200)
+"""
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import threading
+import getopt
+import os
+import sys
+import time
+import tracemalloc
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from actions.catalogue import tle_checksum  # noqa: E402
+from actions.downloadTLE import TLEPageParser  # noqa: E402
+from utility import fetch  # noqa: E402
+
+
+def make_page(size):
+    """A page of about size bytes with the TLE of a satellite at 40% of it."""
+    line1 = "1 24793U 97020B   24290.50000000  .00000100  00000-0  30000-4 0  999"
+    line2 = "2 24793  86.3964 100.1234 0002000  90.0000 270.1234 14.3421600010000"
+    line1, line2 = line1 + str(tle_checksum(line1)), line2 + str(tle_checksum(line2))
+    head = "<!DOCTYPE html><html><head><title>IRIDIUM 7</title>" + "<script>var x = {'a': [1, 2, 3]};</script>" * (size // 200) + "</head><body>"
+    filler = '<div class="row"><span class="label">Perigee</span> <b>779.3 km</b></div>\n'
+    before = filler * max(0, (size * 2 // 5 - len(head)) // len(filler))
+    block = '<div id="tle"><pre>\n{}\n{}\n</pre></div>\n'.format(line1, line2)
+    after = filler * max(0, (size - len(head) - len(before) - len(block)) // len(filler))
+    return (head + before + block + after + "</body></html>").encode(), [line1, line2]
+
+
+def soup_tle(data):
+    """The parsing of the download before TLEPageParser."""
+    from bs4 import BeautifulSoup
+    soup = BeautifulSoup(data, features="html.parser")
+    element = soup.find('div', attrs={'id': 'tle'})
+    if element is None:
+        return ""
+    element = element.find('pre')
+    if element is None:
+        return ""
+    TLE = element.text.strip().split('\n')
+    return [s.strip() for s in TLE]
+
+
+def streaming_tle(data, piece):
+    parser = TLEPageParser()
+    for start in range(0, len(data), piece):
+        if parser.feed(data[start:start+piece]):
+            break
+    return parser.close()
+
+
+def measure(function, repeat, expected):
+    if function() != expected:
+        raise RuntimeError("Wrong TLE extracted")
+    start = time.perf_counter()
+    for _ in range(repeat):
+        function()
+    duration = (time.perf_counter() - start) / repeat
+    tracemalloc.start()
+    function()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return duration, peak
+
+
+def serve(data):
+    """A local HTTP server answering the page to every request, returns the server and its URL."""
+    class PageHandler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def do_GET(self):
+            self.send_response(200)
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            try:
+                self.wfile.write(data)
+            except (BrokenPipeError, ConnectionResetError):
+                pass
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), PageHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, "http://127.0.0.1:{}/".format(server.server_address[1])
+
+
+def measure_fetch(url, repeat, expected, parse):
+    """Time per page and number of connections of fetch_all on repeat pages, 4 at a time."""
+    urls = ["{}?s={}".format(url, i) for i in range(repeat)]
+    start = time.perf_counter()
+    if parse is None:
+        results, connections = fetch.fetch_all(urls, concurrency=4, parser=TLEPageParser)
+    else:
+        results, connections = fetch.fetch_all(urls, concurrency=4)
+        results = [parse(body) for body in results]
+    duration = (time.perf_counter() - start) / repeat
+    if any(result != expected for result in results):
+        raise RuntimeError("Wrong TLE extracted")
+    return duration, connections
+
+
+def main(argv):
+    try:
+        opts, args = getopt.getopt(argv, "", ["size=", "piece=", "repeat="])
+    except getopt.GetoptError as E:
+        print(E)
+        print(__doc__)
+        sys.exit(2)
+    size, piece, repeat = 80 * 1024, 16 * 1024, 200
+    for opt, arg in opts:
+        if opt == "--size":
+            size = int(float(arg) * 1024)
+        elif opt == "--piece":
+            piece = int(float(arg) * 1024)
+        elif opt == "--repeat":
+            repeat = int(arg)
+
+    data, expected = make_page(size)
+    print("Page of {:.0f} KiB, TLE at {:.0f} KiB".format(len(data) / 1024, data.index(b'id="tle"') / 1024))
+    results = {"TLEPageParser": measure(lambda: streaming_tle(data, piece), repeat, expected)}
+    try:
+        results["BeautifulSoup"] = measure(lambda: soup_tle(data), repeat, expected)
+    except ImportError:
+        print("BeautifulSoup is not installed, only TLEPageParser is measured")
+    print("Parsing:")
+    for name, (duration, peak) in results.items():
+        print("    {:<25} {:9.3f} ms/page {:9.0f} KiB peak".format(name, duration * 1000, peak / 1024))
+    if len(results) == 2:
+        print("    TLEPageParser is {:.0f}x faster".format(results["BeautifulSoup"][0] / results["TLEPageParser"][0]))
+
+    server, url = serve(data)
+    fetches = {"TLEPageParser, draining": measure_fetch(url, repeat, expected, None)}
+    drain_limit, fetch.DRAIN_LIMIT = fetch.DRAIN_LIMIT, -1
+    try:
+        fetches["TLEPageParser, closing"] = measure_fetch(url, repeat, expected, None)
+    finally:
+        fetch.DRAIN_LIMIT = drain_limit
+    if len(results) == 2:
+        fetches["BeautifulSoup"] = measure_fetch(url, repeat, expected, soup_tle)
+    server.shutdown()
+    print("Fetch from a local server:")
+    for name, (duration, connections) in fetches.items():
+        print("    {:<25} {:9.3f} ms/page {:9} connections".format(name, duration * 1000, connections))
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
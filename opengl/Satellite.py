@@ -1,12 +1,24 @@
-from utility import header_indexes
+from utility import header_indexes, load_npy_directory
+import os.path
 import math
 import csv
 import glm
+import numpy as np
 
 class Satellite:
     def __init__(self, norad_id):
         self.states = {}          # Positions, line of sight, path loss, indexed by time
         self.norad_id = norad_id  # Norad ID
+        self.times = None         # Sorted times, when the states are given as arrays (see from_arrays)
+        self.arrays = None        # Arrays of longitude, latitude, altitude, los, path loss, same length as times
+
+    @classmethod
+    def from_arrays(cls, norad_id, times, longitudes, latitudes, altitudes, los, path_loss):
+        """Build a satellite whose states are read from (possibly memory-mapped) arrays, without copying them."""
+        satellite = cls(norad_id)
+        satellite.times = times
+        satellite.arrays = (longitudes, latitudes, altitudes, los, path_loss)
+        return satellite
 
     def add_state(self, time, long, lat, altitude, los, path_loss):
         """add_position
@@ -24,6 +36,9 @@ class Satellite:
 
     def at(self, time):
         """Linear interpolation that gives the state of the satellite at any given time."""
+        if self.times is not None:
+            return self._array_at(time)
+
         if time in self.states:
             return self.states[time]
 
@@ -46,6 +61,16 @@ class Satellite:
             interp.append(a + (b-a)*(time-t1)/(t2-t1))
         return interp
 
+    def _array_at(self, time):
+        i = np.searchsorted(self.times, time, side='right')
+        if i == 0 or (i == len(self.times) and time > self.times[-1]):
+            raise RuntimeError("Given time ({} s) is out of range for satellite {}".format(time, self.norad_id))
+        if self.times[i-1] == time:
+            return [float(array[i-1]) for array in self.arrays]
+
+        t1, t2 = self.times[i-1], self.times[i]
+        return [float(array[i-1] + (float(array[i])-float(array[i-1]))*(time-t1)/(t2-t1)) for array in self.arrays]
+
     def posToScene(self, state, earth_x, earth_y, earth_z, earth_radius):
         long, lat, altitude = state[:3]
         u, v = math.radians(lat), math.radians(long)
@@ -60,6 +85,9 @@ def load_from_file(file):
     """Load trajectories from given csv file and returns Satellite objects as satellites, relays;
     with relays a list of Satellite corresponding to the relays.
     Aditionnaly returns t_min and t_max"""
+    if os.path.isdir(file):
+        return load_from_npy(file)
+
     with open(file, 'r') as csvfile:
         reader = csv.reader(csvfile, delimiter=',')
 
@@ -90,6 +118,24 @@ def load_from_file(file):
     return satellite, relays, min(times), max(times)
 
 
+def load_from_npy(directory):
+    """Same as load_from_file, for a directory written with --format npy.
+    The arrays are memory-mapped, nothing is parsed nor copied."""
+    header, arrays = load_npy_directory(directory)
+    if not header.get("write_trajectories") or "relays_position" not in arrays:
+        raise RuntimeError("\"{}\" has been generated without --write-trajectories.".format(directory))
+
+    times = arrays["time"]
+    satellite = Satellite.from_arrays("satellite", times, arrays["longitude"], arrays["latitude"], arrays["altitude"],
+                                      np.zeros(len(times)), np.zeros(len(times)))
+    positions = arrays["relays_position"]
+    # Path loss at the first frequency when several have been calculated
+    path_loss = arrays["path_loss"] if arrays["path_loss"].ndim == 2 else arrays["path_loss"][:, :, 0]
+    relays = [Satellite.from_arrays(name, times, positions[:, i, 0], positions[:, i, 1], positions[:, i, 2], arrays["los"][:, i], path_loss[:, i])
+              for i, name in enumerate(header["relays"])]
+    return satellite, relays, float(times[0]), float(times[-1])
+
+
 def b2f(b):
     """bool to float"""
     return 1.0 if b == "True" else 0.0
@@ -0,0 +1,167 @@
+"""utility.fetch_all and actions.downloadTLE.TLEPageParser against a local stand-in of the tracking website.
+
+Run with: python -m pytest tests (or python -m unittest discover tests)
+"""
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import collections
+import threading
+import unittest
+import os
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from actions.catalogue import tle_checksum  # noqa: E402
+from actions.downloadTLE import TLEPageParser  # noqa: E402
+from utility.fetch import fetch_all, FetchError  # noqa: E402
+
+LINE1 = "1 24793U 97020B   24290.50000000  .00000100  00000-0  30000-4 0  999"
+LINE2 = "2 24793  86.3964 100.1234 0002000  90.0000 270.1234 14.3421600010000"
+LINE1, LINE2 = LINE1 + str(tle_checksum(LINE1)), LINE2 + str(tle_checksum(LINE2))
+FILLER = '<div class="row"><b>779.3 km</b></div>\n' * 500
+
+
+def tle_page(line1, line2):
+    return "<html><body>{}<div id=\"tle\"><pre>\nIRIDIUM 7\n{}\n{}\n</pre></div>{}</body></html>".format(FILLER, line1, line2, FILLER)
+
+
+class StandInHandler(BaseHTTPRequestHandler):
+    """/busy answers 503 to the first two requests, /stall never answers in time, /missing is a 404,
+    /tle, /no-tle and /bad-tle are pages with a valid TLE, without TLE and with a wrong checksum,
+    /loop redirects to itself, /moved redirects to /tle and /not-modified is a 304."""
+
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        server = self.server
+        with server.lock:
+            server.hits[self.path] += 1
+            server.starts.append(time.monotonic())
+            server.connections.add(self.client_address)
+            hits = server.hits[self.path]
+        if self.path.startswith("/busy") and hits <= 2:
+            self.reply(503, "busy")
+        elif self.path.startswith("/stall"):
+            time.sleep(1)
+            self.reply(200, "late")
+        elif self.path.startswith("/tle"):
+            self.reply(200, tle_page(LINE1, LINE2))
+        elif self.path.startswith("/no-tle"):
+            self.reply(200, "<html><body>{}</body></html>".format(FILLER))
+        elif self.path.startswith("/bad-tle"):
+            self.reply(200, tle_page(LINE1, LINE2[:-1] + str((int(LINE2[-1]) + 1) % 10)))
+        elif self.path.startswith("/missing"):
+            self.reply(404, "not found")
+        elif self.path.startswith("/loop"):
+            self.reply(302, "", {"Location": "/loop"})
+        elif self.path.startswith("/moved"):
+            self.reply(301, "", {"Location": "/tle"})
+        elif self.path.startswith("/not-modified"):
+            self.reply(304, "")
+        else:
+            self.reply(200, "ok " + self.path)
+
+    def reply(self, status, text, headers={}):
+        data = text.encode()
+        try:
+            self.send_response(status)
+            for name, value in headers.items():
+                self.send_header(name, value)
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+        except (BrokenPipeError, ConnectionResetError):
+            # The client gave up (timeout)
+            pass
+
+    def log_message(self, format, *args):
+        pass
+
+
+class FetchTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.server = ThreadingHTTPServer(("127.0.0.1", 0), StandInHandler)
+        cls.server.lock = threading.Lock()
+        cls.base = "http://127.0.0.1:{}".format(cls.server.server_address[1])
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+
+    def setUp(self):
+        with self.server.lock:
+            self.server.hits = collections.Counter()
+            self.server.starts = []
+            self.server.connections = set()
+
+    def fetch(self, paths, **options):
+        options.setdefault("backoff", 0.01)
+        return fetch_all([self.base + path for path in paths], **options)
+
+    def test_server_error_is_retried(self):
+        (body,), _ = self.fetch(["/busy"], retries=3)
+        self.assertEqual(body, b"ok /busy")
+        self.assertEqual(self.server.hits["/busy"], 3)
+
+    def test_stalled_answer_times_out(self):
+        (error,), _ = self.fetch(["/stall"], timeout=0.2, retries=2)
+        self.assertIsInstance(error, FetchError)
+        self.assertIn("3 attempts", str(error))
+        self.assertEqual(self.server.hits["/stall"], 3)
+
+    def test_client_error_is_not_retried(self):
+        (error,), _ = self.fetch(["/missing"], retries=3)
+        self.assertIsInstance(error, FetchError)
+        self.assertIn("404", str(error))
+        self.assertEqual(self.server.hits["/missing"], 1)
+
+    def test_rate_limit_spaces_the_requests(self):
+        rate = 20
+        results, _ = self.fetch(["/page{}".format(i) for i in range(6)], concurrency=6, rate=rate)
+        self.assertEqual(results, [b"ok /page" + str(i).encode() for i in range(6)])
+        starts = sorted(self.server.starts)
+        # Some tolerance for the scheduling of the server threads
+        self.assertGreaterEqual(starts[-1] - starts[0], 5 / rate * 0.8)
+        self.assertTrue(all(b - a >= 1 / rate * 0.5 for a, b in zip(starts, starts[1:])))
+
+    def test_connections_are_reused(self):
+        results, opened = self.fetch(["/page{}".format(i) for i in range(20)], concurrency=2)
+        self.assertEqual(len(results), 20)
+        self.assertLessEqual(opened, 2)
+        self.assertEqual(len(self.server.connections), opened)
+
+    def test_tle_pages(self):
+        (tle, no_tle, bad_tle), _ = self.fetch(["/tle", "/no-tle", "/bad-tle"], parser=TLEPageParser)
+        self.assertEqual(tle, [LINE1, LINE2])
+        self.assertEqual(no_tle, [])
+        self.assertIsInstance(bad_tle, FetchError)
+        self.assertIn("invalid TLE", str(bad_tle))
+        self.assertEqual(self.server.hits["/bad-tle"], 1)
+
+    def test_unfollowed_redirections(self):
+        (moved, loop, not_modified), _ = self.fetch(["/moved", "/loop", "/not-modified"], retries=3, parser=TLEPageParser)
+        self.assertEqual(moved, [LINE1, LINE2])
+        self.assertIsInstance(loop, FetchError)
+        self.assertIn("too many redirections", str(loop))
+        self.assertEqual(self.server.hits["/loop"], 6)
+        self.assertIsInstance(not_modified, FetchError)
+        self.assertIn("304", str(not_modified))
+        self.assertEqual(self.server.hits["/not-modified"], 1)
+
+    def test_tle_page_by_small_pieces(self):
+        data = tle_page(LINE1, LINE2).encode()
+        parser = TLEPageParser()
+        for start in range(0, len(data), 7):
+            if parser.feed(data[start:start+7]):
+                break
+        self.assertEqual(parser.close(), [LINE1, LINE2])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,93 @@
+"""actions.propagation.interpolate_relays on relays with several element sets, around the switches between them.
+
+Run with: python -m pytest tests (or python -m unittest discover tests)
+"""
+import unittest
+import os
+import sys
+
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from actions.api import timescale  # noqa: E402
+from actions.catalogue import tle_checksum  # noqa: E402
+from actions.propagation import make_relays, propagate_relays, interpolate_relays, utc_times  # noqa: E402
+
+# Epochs of the element sets (days of 2024), the switch between the first two is at 2024-10-17 12:00 UTC
+EPOCHS = ["24288.50000000", "24290.50000000", "24292.50000000"]
+SWITCH = 1729166400
+
+
+def element_set(norad_id, epoch, node, anomaly):
+    line1 = "1 {}U 17003A   {}  .00000100  00000-0  30000-4 0  999".format(norad_id, epoch)
+    line2 = "2 {}  86.4000 {:8.4f} 0002000  90.0000 {:8.4f} 14.3421600010000".format(norad_id, node, anomaly)
+    return str(norad_id), line1 + str(tle_checksum(line1)), line2 + str(tle_checksum(line2))
+
+
+def relays():
+    """Three relays with three element sets each, whose positions jump at each switch, and a relay with one element set."""
+    element_sets = [element_set(40000 + i, epoch, 30.0 * i, (330.0 + 30.0 * k + 7.0 * i) % 360)
+                    for i in range(3) for k, epoch in enumerate(EPOCHS)]
+    element_sets.append(element_set(40003, EPOCHS[1], 90.0, 45.0))
+    return make_relays(element_sets)
+
+
+class InterpolationTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.ts = timescale()
+        cls.satellites = relays()
+
+    def check(self, times, step=60, max_error=1.0):
+        stats = {}
+        interpolated = interpolate_relays(self.satellites, self.ts, times, step, max_error, stats)
+        exact = propagate_relays(self.satellites, utc_times(self.ts, times), times)
+        error = np.max(np.linalg.norm(interpolated - exact, axis=-1))
+        self.assertLessEqual(error, max_error)
+        self.assertLessEqual(stats["interpolation_error_max"], max_error)
+        return stats
+
+    def test_element_sets_jump(self):
+        # Otherwise the test would not reproduce anything
+        times = np.array([SWITCH - 1.0, SWITCH + 1.0])
+        positions = propagate_relays(self.satellites, utc_times(self.ts, times), times)
+        self.assertGreater(np.min(np.linalg.norm(positions[1, :3] - positions[0, :3], axis=-1)), 100e3)
+
+    def test_across_a_switch(self):
+        stats = self.check(SWITCH + np.arange(-3600.0, 3600.0, 10.0))
+        # 7 grid intervals of 60 s around the switch, for the 3 relays with several element sets
+        self.assertGreater(stats["interpolation_exact_points"], 0)
+        self.assertLessEqual(stats["interpolation_exact_points"], 3 * 7 * 60 // 10)
+
+    def test_switch_between_points(self):
+        # Sparse points, the switch is between two of them but inside the stencil of both
+        self.check(SWITCH + np.array([-150.0, -45.0, 5.0, 75.0, 200.0]))
+
+    def test_several_switches(self):
+        self.check(SWITCH + np.arange(-86400.0, 3 * 86400.0, 97.0), step=120)
+
+    def test_without_switch(self):
+        stats = self.check(SWITCH + np.arange(3600.0, 7200.0, 10.0))
+        self.assertEqual(stats["interpolation_exact_points"], 0)
+
+
+class PropagatorTest(unittest.TestCase):
+
+    def test_sgp4_matches_skyfield(self):
+        ts = timescale()
+        satellites = relays()
+        # Without and across a switch of element set
+        for start in (SWITCH + 3600.0, SWITCH - 1800.0):
+            times = start + np.arange(0.0, 3600.0, 7.0)
+            time = utc_times(ts, times)
+            skyfield = propagate_relays(satellites, time, times, propagator="skyfield")
+            sgp4 = propagate_relays(satellites, time, times, propagator="sgp4")
+            self.assertFalse(np.any(np.isnan(skyfield)))
+            self.assertLess(np.max(np.linalg.norm(sgp4 - skyfield, axis=-1)), 1e-6)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,70 @@
+"""actions.store.TLEStore: the history of the TLE of each satellite.
+
+Run with: python -m pytest tests (or python -m unittest discover tests)
+"""
+import tempfile
+import unittest
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from actions.catalogue import tle_checksum  # noqa: E402
+from actions.store import TLEStore, tle_epoch  # noqa: E402
+
+
+def element_set(epoch, anomaly):
+    line1 = "1 40000U 17003A   {}  .00000100  00000-0  30000-4 0  999".format(epoch)
+    line2 = "2 40000  86.4000  30.0000 0002000  90.0000 {:8.4f} 14.3421600010000".format(anomaly)
+    return line1 + str(tle_checksum(line1)), line2 + str(tle_checksum(line2))
+
+
+OLD, NEW, NEW_AGAIN = element_set("24288.50000000", 10.0), element_set("24290.50000000", 50.0), element_set("24290.50000000", 51.0)
+
+
+class StoreTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.file = os.path.join(self.directory.name, "store.csv")
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_history(self):
+        store = TLEStore(self.file)
+        store.put("40000", *NEW, fetched=2000.0)
+        store.put("40000", *OLD, fetched=1000.0)
+        self.assertEqual(store.get("40000"), list(NEW))
+        self.assertEqual(store.history("40000"), [list(OLD), list(NEW)])
+        self.assertEqual(store.history("40001"), [])
+
+        # A TLE of the same epoch replaces the one of the store
+        store.put("40000", *NEW_AGAIN, fetched=3000.0)
+        self.assertEqual(store.history("40000"), [list(OLD), list(NEW_AGAIN)])
+
+        store.save()
+        self.assertEqual(TLEStore(self.file).history("40000"), [list(OLD), list(NEW_AGAIN)])
+
+    def test_history_age(self):
+        store = TLEStore(self.file, history_age=86400)
+        store.put("40000", *OLD, fetched=1000.0)
+        store.put("40000", *NEW, fetched=2000.0)
+        self.assertEqual(store.history("40000"), [list(NEW)])
+        # An element set older than the window is not added back
+        store.put("40000", *OLD, fetched=3000.0)
+        self.assertEqual(store.history("40000"), [list(NEW)])
+
+    def test_freshness_of_the_latest(self):
+        store = TLEStore(self.file)
+        store.put("40000", *OLD, fetched=0.0)
+        store.put("40000", *NEW, fetched=0.0)
+        epoch = tle_epoch(NEW[0])
+        self.assertTrue(store.is_fresh("40000", 86400, now=epoch + 3600))
+        self.assertFalse(store.is_fresh("40000", 86400, now=epoch + 2 * 86400))
+        self.assertFalse(store.is_fresh("40001", 86400, now=epoch))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,66 @@
+"""actions.trajectory: line of sight, closest relay and calculation by worker processes.
+
+Run with: python -m pytest tests (or python -m unittest discover tests)
+"""
+import unittest
+import os
+import sys
+
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from actions.api import timescale  # noqa: E402
+from actions.catalogue import tle_checksum  # noqa: E402
+from actions.output import csv_header, chunk_rows  # noqa: E402
+from actions.propagation import make_relays  # noqa: E402
+from actions.trajectory import attenuation, attenuation_chunks  # noqa: E402
+
+
+def constellation(count=12, planes=3):
+    """count relays in polar orbits at 780 km, spread over planes."""
+    element_sets = []
+    for i in range(count):
+        plane, rank = divmod(i, count // planes)
+        line1 = "1 {}U 17003A   24290.50000000  .00000100  00000-0  30000-4 0  999".format(40000 + i)
+        line2 = "2 {}  86.4000 {:8.4f} 0002000  90.0000 {:8.4f} 14.3421600010000".format(
+            40000 + i, plane * 60.0, rank * 360.0 * planes / count)
+        element_sets.append((str(40000 + i), line1 + str(tle_checksum(line1)), line2 + str(tle_checksum(line2))))
+    return make_relays(element_sets)
+
+
+class AttenuationTest(unittest.TestCase):
+
+    def test_failed_relay_is_not_in_sight(self):
+        # A target on the equator, a relay whose propagation failed and a relay 1000 km above the target
+        target_pos = np.array([[6378137.0, 0.0, 0.0]])
+        relays_pos = np.array([[[np.nan, np.nan, np.nan], [7378137.0, 0.0, 0.0]]])
+        dist, los, losses = attenuation(target_pos, relays_pos, 1616e6)
+        self.assertEqual(los.tolist(), [[False, True]])
+        self.assertTrue(np.isnan(losses[0, 0]))
+        self.assertAlmostEqual(dist[0, 1], 1e6)
+        self.assertEqual(np.argmin(np.where(los, dist, np.inf), axis=1).tolist(), [1])
+
+
+class JobsTest(unittest.TestCase):
+
+    def calculate(self, jobs):
+        satellites = constellation()
+        times = 1729080000.0 + np.arange(0.0, 600.0, 5.0)
+        longitudes, latitudes = np.linspace(2.0, 8.0, len(times)), np.linspace(43.0, 48.0, len(times))
+        altitudes = np.linspace(120000.0, 10000.0, len(times))
+        rows = [csv_header(list(satellites), True)]
+        for part, chunk in attenuation_chunks(satellites, timescale(), times, longitudes, latitudes, altitudes, 1616e6, True, 25, jobs):
+            rows.extend(chunk_rows(chunk, list(satellites), True))
+        return rows
+
+    def test_workers_give_the_serial_output(self):
+        serial = self.calculate(1)
+        self.assertEqual(len(serial), 121)
+        self.assertTrue(any(row[5] != "None" for row in serial[1:]))
+        self.assertEqual(self.calculate(2), serial)
+
+
+if __name__ == '__main__':
+    unittest.main()
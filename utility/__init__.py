@@ -1,2 +1,7 @@
+from .cache import ArrayCache
 from .confirmation import confirmation
 from .csv import header_indexes
+from .memory import current_memory, peak_memory
+from .npy import NpyDirectoryWriter, load_npy_directory
+from .profiler import Profiler, timed
+from .writer import CSVWriterThread
@@ -0,0 +1,84 @@
+import threading
+import hashlib
+import uuid
+import os
+
+import numpy as np
+
+
+class ArrayCache:
+    """Persistent cache of numpy arrays, one .npy file per entry in a directory.
+
+    When the total size of the entries exceeds max_size bytes, the least recently used entries are removed.
+    The recency of an entry is the modification time of its file, updated on every hit.
+    Several processes and threads can share the same directory: entries are written to a temporary file of their own
+    then renamed.
+    """
+
+    def __init__(self, directory, max_size):
+        self.directory = directory
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+        self._size = sum(entry.stat().st_size for entry in self._entries())
+
+    @staticmethod
+    def key(*parts):
+        """Hash the given strings or bytes into an entry key."""
+        digest = hashlib.sha1()
+        for part in parts:
+            digest.update(part.encode() if isinstance(part, str) else bytes(part))
+            digest.update(b"\0")
+        return digest.hexdigest()
+
+    def get(self, key):
+        """Returns the array stored for key, or None if it is not in the cache."""
+        path = self._path(key)
+        try:
+            array = np.load(path)
+            os.utime(path)
+        except (OSError, ValueError):
+            self.misses += 1
+            return None
+        self.hits += 1
+        return array
+
+    def put(self, key, array):
+        path = self._path(key)
+        temporary = "{}.{}.tmp".format(path, uuid.uuid4().hex)
+        with open(temporary, 'wb') as file:
+            np.save(file, array)
+            size = file.tell()
+        os.replace(temporary, path)
+        with self._lock:
+            self._size += size
+            if self._size > self.max_size:
+                self._evict()
+
+    def _path(self, key):
+        return os.path.join(self.directory, key + ".npy")
+
+    def _entries(self):
+        return [entry for entry in os.scandir(self.directory) if entry.name.endswith(".npy")]
+
+    def _evict(self):
+        entries = []
+        for entry in self._entries():
+            try:
+                stat = entry.stat()
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, entry.path))
+        entries.sort()
+
+        self._size = sum(size for _, size, _ in entries)
+        for _, size, path in entries:
+            if self._size <= self.max_size:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            self._size -= size
@@ -0,0 +1,227 @@
+import urllib.parse
+import asyncio
+import random
+import time
+import ssl
+
+
+class FetchError(RuntimeError):
+    """A request that failed, after all its attempts if retryable is True."""
+
+    def __init__(self, message, retryable=True):
+        super().__init__(message)
+        self.retryable = retryable
+
+
+class RateLimiter:
+    """Space the starts of the requests so there are at most rate requests per second (no limit if rate is None)."""
+
+    def __init__(self, rate=None):
+        self.interval = 1 / rate if rate else 0
+        self.next_start = 0
+        self._lock = asyncio.Lock()
+
+    async def wait(self):
+        if not self.interval:
+            return
+        async with self._lock:
+            now = time.monotonic()
+            delay = self.next_start - now
+            self.next_start = max(now, self.next_start) + self.interval
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+
+class ConnectionPool:
+    """Keep-alive HTTP/1.1 connections, reused by the successive requests to the same host."""
+
+    def __init__(self):
+        self.idle = {}  # (scheme, host, port) -> list of (reader, writer)
+        self.opened = 0
+        self._ssl = None
+
+    async def acquire(self, scheme, host, port):
+        connections = self.idle.get((scheme, host, port))
+        while connections:
+            reader, writer = connections.pop()
+            # The server may have closed an idle connection
+            if not reader.at_eof() and not writer.is_closing():
+                return reader, writer
+            writer.close()
+        if scheme == "https" and self._ssl is None:
+            self._ssl = ssl.create_default_context()
+        self.opened += 1
+        return await asyncio.open_connection(host, port, ssl=self._ssl if scheme == "https" else None)
+
+    def release(self, key, connection):
+        self.idle.setdefault(key, []).append(connection)
+
+    def close(self):
+        for connections in self.idle.values():
+            for _, writer in connections:
+                writer.close()
+        self.idle.clear()
+
+
+# Size of the pieces the bodies are read by
+READ_SIZE = 64 * 1024
+# Once a parser has what it needs, at most this number of bytes of the body are read (and discarded) to reuse the
+# connection, larger bodies are abandoned by closing the connection
+DRAIN_LIMIT = 256 * 1024
+
+
+async def _body_chunks(reader, headers):
+    """Pieces of the body of an answer, as they arrive."""
+    if headers.get("transfer-encoding", "").lower() == "chunked":
+        while True:
+            size = int((await reader.readline()).split(b";")[0], 16)
+            if size == 0:
+                # Trailer, up to the empty line
+                while (await reader.readline()).strip():
+                    pass
+                return
+            while size > 0:
+                data = await reader.readexactly(min(size, READ_SIZE))
+                size -= len(data)
+                yield data
+            await reader.readline()
+    elif "content-length" in headers:
+        size = int(headers["content-length"])
+        while size > 0:
+            data = await reader.readexactly(min(size, READ_SIZE))
+            size -= len(data)
+            yield data
+    else:
+        while True:
+            data = await reader.read(READ_SIZE)
+            if not data:
+                return
+            yield data
+
+
+async def _get(pool, url, parser=None):
+    """One GET request on a pooled connection. Returns (status, headers, body).
+
+    With a parser, the pieces of the body are given to parser.feed() as they arrive, until it returns True, and the body is
+    the result of parser.close(). Otherwise the body is the bytes of the answer.
+    """
+    parts = urllib.parse.urlsplit(url)
+    if parts.scheme not in ("http", "https"):
+        raise FetchError("Unsupported URL \"{}\"".format(url), retryable=False)
+    key = (parts.scheme, parts.hostname, parts.port or (443 if parts.scheme == "https" else 80))
+    target = (parts.path or "/") + ("?" + parts.query if parts.query else "")
+    reader, writer = await pool.acquire(*key)
+    reusable = True
+    try:
+        writer.write("GET {} HTTP/1.1\r\nHost: {}\r\nUser-Agent: attenuationCalc\r\nAccept-Encoding: identity\r\nConnection: keep-alive\r\n\r\n"
+                     .format(target, parts.netloc).encode("latin-1"))
+        await writer.drain()
+        status_line = await reader.readline()
+        if not status_line:
+            raise ConnectionResetError("Connection closed by the server")
+        status = int(status_line.split()[1])
+        headers = {}
+        while True:
+            line = (await reader.readline()).decode("latin-1").strip()
+            if not line:
+                break
+            name, _, value = line.partition(":")
+            headers[name.strip().lower()] = value.strip()
+
+        chunks = _body_chunks(reader, headers)
+        if parser is None or status >= 300:
+            body = b"".join([data async for data in chunks])
+        else:
+            done, drained = False, 0
+            async for data in chunks:
+                if not done:
+                    done = parser.feed(data)
+                    continue
+                drained += len(data)
+                if drained > DRAIN_LIMIT:
+                    reusable = False
+                    break
+            await chunks.aclose()
+            body = parser.close()
+    except BaseException:
+        writer.close()
+        raise
+    if not reusable or headers.get("connection", "").lower() == "close" or "content-length" not in headers and "transfer-encoding" not in headers:
+        writer.close()
+    else:
+        pool.release(key, (reader, writer))
+    return status, headers, body
+
+
+async def fetch(pool, limiter, url, timeout=30, retries=3, backoff=1.0, redirects=5, parser=None):
+    """GET the URL and return the body, or what parser() makes of it (see _get).
+
+    Each attempt waits for the rate limiter and must be answered within timeout seconds. The attempts failing with a
+    connection error, a timeout, a 429 or a 5xx status are retried up to retries times, after backoff seconds, doubled
+    at each retry (with some jitter). Other errors raise a FetchError at once, as well as the 3xx answers that are
+    not followed (no Location, 304, more than redirects redirections).
+    """
+    attempt = 0
+    while True:
+        await limiter.wait()
+        try:
+            status, headers, body = await asyncio.wait_for(_get(pool, url, parser() if parser is not None else None), timeout)
+            redirection = status in (301, 302, 303, 307, 308) and "location" in headers
+            if redirection and redirects > 0:
+                url, redirects = urllib.parse.urljoin(url, headers["location"]), redirects - 1
+                continue
+            if status == 429 or status >= 500:
+                raise FetchError("HTTP error {}".format(status))
+            if status >= 400:
+                raise FetchError("HTTP error {}".format(status), retryable=False)
+            if status >= 300:
+                # Its body is not the page, nor what the parser expects
+                raise FetchError("HTTP status {} not followed{}".format(status, " (too many redirections)" if redirection else ""),
+                                 retryable=False)
+            return body
+        except (OSError, asyncio.TimeoutError, asyncio.IncompleteReadError, ValueError, FetchError) as E:
+            if isinstance(E, FetchError) and not E.retryable:
+                raise
+            if attempt >= retries:
+                message = "timeout after {} s".format(timeout) if isinstance(E, asyncio.TimeoutError) else str(E) or type(E).__name__
+                raise FetchError("{} ({} attempts)".format(message, attempt + 1), retryable=False)
+        await asyncio.sleep(backoff * 2**attempt * random.uniform(0.5, 1.5))
+        attempt += 1
+
+
+def fetch_all(urls, concurrency=8, rate=None, timeout=30, retries=3, backoff=1.0, callback=None, parser=None):
+    """Download the URLs concurrently, over at most concurrency keep-alive connections.
+
+    Args:
+        urls: the URLs to GET
+        concurrency: maximum number of requests in progress at the same time
+        rate: maximum number of requests started per second, or None
+        timeout, retries, backoff: see fetch
+        callback: function(index, result) called as soon as each URL is done, or None
+        parser: class of an incremental parser of the bodies, with the methods feed(data) returning True once it has all
+            it needs, and close() returning the result or raising a FetchError, or None
+    Returns:
+        list of the body (bytes, or the result of the parser) or of the FetchError of every URL, in the order of urls,
+        and the number of connections opened
+    """
+    async def run():
+        pool, limiter = ConnectionPool(), RateLimiter(rate)
+        semaphore = asyncio.Semaphore(concurrency)
+        results = [None] * len(urls)
+
+        async def download(index):
+            async with semaphore:
+                try:
+                    results[index] = await fetch(pool, limiter, urls[index], timeout, retries, backoff, parser=parser)
+                except FetchError as E:
+                    results[index] = E
+            if callback is not None:
+                callback(index, results[index])
+
+        try:
+            await asyncio.gather(*(download(i) for i in range(len(urls))))
+        finally:
+            pool.close()
+        return results, pool.opened
+
+    return asyncio.run(run())
@@ -0,0 +1,68 @@
+import json
+import os
+
+import numpy as np
+
+
+HEADER_FILE = "header.json"
+
+
+class NpyDirectoryWriter:
+    """Write columnar data to a directory holding one .npy file per quantity and a JSON header.
+
+    Every quantity is an array whose first axis is the point index, the files are written with the header of the final
+    array and the points are appended chunk by chunk with write(). The data is not memory-mapped while writing,
+    so the written points do not stay in the memory of the process.
+    Use it as a context manager: the files are closed when leaving the block.
+    """
+
+    def __init__(self, directory, header, columns):
+        """
+        Args:
+            directory: the directory where the files are written, created if needed.
+            header: a JSON serializable dict saved in header.json.
+            columns: dict of name -> (shape, dtype) of each quantity.
+        """
+        self.directory = directory
+        self.header = header
+        self.columns = columns
+        self._files = {}
+
+    def __enter__(self):
+        os.makedirs(self.directory, exist_ok=True)
+        with open(os.path.join(self.directory, HEADER_FILE), 'w') as file:
+            json.dump(self.header, file, indent=1)
+        for name, (shape, dtype) in self.columns.items():
+            file = open(os.path.join(self.directory, name + ".npy"), 'wb')
+            np.lib.format.write_array_header_1_0(file, {"descr": np.lib.format.dtype_to_descr(np.dtype(dtype)), "fortran_order": False, "shape": shape})
+            self._files[name] = (file, dtype)
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        for file, dtype in self._files.values():
+            file.close()
+        self._files = {}
+
+    def write(self, chunk):
+        """Write the next points, chunk is a dict of name -> array holding the same number of points for every quantity."""
+        for name, (file, dtype) in self._files.items():
+            file.write(np.ascontiguousarray(chunk[name], dtype=dtype).tobytes())
+
+
+def load_npy_directory(directory):
+    """Open a directory written by NpyDirectoryWriter without copying the data.
+
+    Returns:
+        the header dict and a dict of name -> read-only memory-mapped array
+    """
+    header_file = os.path.join(directory, HEADER_FILE)
+    if not os.path.isfile(header_file):
+        raise RuntimeError("\"{}\" is missing in \"{}\".".format(HEADER_FILE, directory))
+    with open(header_file, 'r') as file:
+        header = json.load(file)
+
+    arrays = {}
+    for file in os.listdir(directory):
+        if file.endswith(".npy"):
+            arrays[file[:-4]] = np.load(os.path.join(directory, file), mmap_mode='r')
+    return header, arrays
@@ -0,0 +1,76 @@
+import contextlib
+import json
+import time
+
+
+@contextlib.contextmanager
+def timed(stats, stage, points=0):
+    """Add the wall time of the block, one call and the number of points processed to the stage in stats.
+
+    stats is a statistics dict (see actions.trajectory.merge_stats), the keys "profile:<stage>:seconds", ":calls" and ":points"
+    are summed so the stages timed in worker processes add up. Nothing is recorded if stats is None.
+    """
+    if stats is None:
+        yield
+        return
+    keys = ["profile:{}:{}".format(stage, key) for key in ("seconds", "calls", "points")]
+    # Recorded when the stage starts, so that the nested stages follow their parent
+    for key in keys:
+        stats.setdefault(key, 0)
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        for key, value in zip(keys, (time.perf_counter() - start, 1, points)):
+            stats[key] += value
+
+
+class Profiler:
+    """Wall time, number of calls and number of points of the stages of a run.
+
+    The stages are reported in the order they have been started, so the nested stages follow their parent.
+    """
+
+    def __init__(self):
+        self.stages = {}  # Stage name -> [seconds, calls, points]
+
+    def _stage(self, name):
+        return self.stages.setdefault(name, [0.0, 0, 0])
+
+    @contextlib.contextmanager
+    def stage(self, name, points=0):
+        """Time the block as one call of the stage."""
+        stage = self._stage(name)
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            stage[0] += time.perf_counter() - start
+            stage[1] += 1
+            stage[2] += points
+
+    def add_stats(self, stats, parent=""):
+        """Add the stages recorded by timed() in stats, their names are prefixed by parent."""
+        for key, value in stats.items():
+            if key.startswith("profile:"):
+                name, field = key[len("profile:"):].rsplit(":", 1)
+                self._stage(parent + name)[("seconds", "calls", "points").index(field)] += value
+
+    def as_dict(self):
+        return {name: {"seconds": seconds, "calls": calls, "points": points,
+                       "points_per_second": points / seconds if points and seconds > 0 else None}
+                for name, (seconds, calls, points) in self.stages.items()}
+
+    def report(self):
+        """The table of the stages, as a string."""
+        lines = ["{:<40} {:>10} {:>8} {:>12} {:>12}".format("stage", "wall (s)", "calls", "points", "points/s")]
+        for name, stage in self.as_dict().items():
+            lines.append("{:<40} {:>10.3f} {:>8} {:>12} {:>12}".format(
+                name, stage["seconds"], stage["calls"], stage["points"] or "",
+                "{:.0f}".format(stage["points_per_second"]) if stage["points_per_second"] else ""))
+        return "\n".join(lines)
+
+    def save(self, file):
+        """Write the stages in a JSON file."""
+        with open(file, 'w') as f:
+            json.dump(self.as_dict(), f, indent=2)
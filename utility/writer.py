@@ -0,0 +1,61 @@
+import threading
+import queue
+import csv
+
+
+class CSVWriterThread:
+    """Write rows to a CSV file from a background thread.
+
+    Rows are handed over in chunks through a bounded queue, so the producer can compute the next chunk
+    while the previous one is written, and at most max_chunks chunks are held in memory.
+    Use it as a context manager: the file is flushed and closed when leaving the block.
+    """
+
+    def __init__(self, file, header, max_chunks=4):
+        self.file = file
+        self.header = header
+        self._queue = queue.Queue(maxsize=max_chunks)
+        self._thread = None
+        self._error = None
+
+    def __enter__(self):
+        self._csvfile = open(self.file, 'w', newline='')
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self._queue.put(None)
+        self._thread.join()
+        self._csvfile.close()
+        if self._error is not None and exc_type is None:
+            raise RuntimeError("Cannot write \"{}\" ({}).".format(self.file, self._error))
+
+    def write_rows(self, rows):
+        """Queue a chunk of rows, blocks while the queue is full."""
+        if self._error is not None:
+            raise RuntimeError("Cannot write \"{}\" ({}).".format(self.file, self._error))
+        self._queue.put(rows)
+
+    def write_text(self, text):
+        """Queue a chunk of rows already formatted as CSV text, which takes much less memory than the rows."""
+        self.write_rows(text)
+
+    def _run(self):
+        writer = csv.writer(self._csvfile, delimiter=',')
+        try:
+            writer.writerow(self.header)
+            while True:
+                rows = self._queue.get()
+                if rows is None:
+                    break
+                if isinstance(rows, str):
+                    self._csvfile.write(rows)
+                else:
+                    writer.writerows(rows)
+                self._csvfile.flush()
+        except OSError as E:
+            self._error = E
+            # Keep draining the queue so the producer is never blocked
+            while self._queue.get() is not None:
+                pass